@@ -4,15 +4,18 @@ Backend: Flask Server with MySQL Authentication & Google OAuth
 Updated with Email OTP Verification, Password Reset, and Smart Chat Titles
 """
 
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, send_from_directory
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, send_from_directory, make_response, g
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 import os
 import sys
 import secrets
+import hashlib
 import requests
 import base64
 import json
+import re
+import time
 
 # Add backend directory to path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -21,12 +24,38 @@ from database import (
     create_user, verify_user, get_user_by_id, get_user_by_email,
     create_google_user, update_user_password, update_user_details,
     save_health_profile, get_health_profile,
-    create_chat_session, get_chat_sessions, update_session_title, delete_chat_session,
-    save_chat_message, get_chat_history, clear_chat_history,get_connection
+    create_chat_session, get_chat_sessions, update_session_title,
+    save_chat_message, get_chat_history, get_connection,
+    get_chat_history_tail, get_chat_history_page, get_active_medication_names,
+    get_medication_dashboard, mark_user_write,
+    log_medication_slots, get_adherence, rebuild_adherence_rollups, get_chat_delete_bound,
+    ensure_schema
+)
+from cache import cached_lookup, invalidate, get_cache_stats
+from reminder_scheduler import (
+    start_scheduler, reschedule_medication, unschedule_medication, pop_due_events,
+    is_running as reminder_scheduler_running, get_scheduler_stats, set_user_timezone, local_today
 )
 from db_config import GOOGLE_CLIENT_ID, GOOGLE_CLIENT_SECRET, GOOGLE_REDIRECT_URI
-from sage_ai import get_sage_instance, clear_sage_instance, generate_chat_title
-from email_utils import send_verification_otp, send_password_reset_otp, verify_otp
+from sage_ai import (
+    get_sage_instance, clear_sage_instance, switch_sage_session, generate_chat_title,
+    HISTORY_MAX_MESSAGES, get_prompt_cache_stats, _sage_instances
+)
+from email_utils import send_verification_otp, send_password_reset_otp, verify_otp, get_mail_queue_stats
+from delete_jobs import start_clear_history_job, start_delete_session_job, get_job, pending_session_deletes
+from medicine_index import cached_search_medicines, refresh_medicine_index, start_background_refresh, check_medications
+from rate_limit import check_rate_limit, get_rate_limit_stats
+from passwords import hash_password, PasswordHasherBusy, PASSWORD_HASH_RETRY_AFTER, get_hasher_stats
+from llm_scheduler import admit, LLMOverloaded, CHAT_COST, IMAGE_COST, get_llm_queue_stats
+from idempotency import idempotency_key, request_fingerprint, run_once, IdempotencyKeyReused
+from assets import asset_url, send_asset
+from responses import install_response_encoding
+from metrics import Gauge, REQUEST_SECONDS, render as render_metrics
+from tracing import start_trace, finish_trace
+from profiler import start_profile, get_profile_status, PROFILE_DIR
+from logs import get_logger, get_logging_stats
+
+logger = get_logger(__name__)
 
 app = Flask(
     __name__,
@@ -36,6 +65,12 @@ app = Flask(
 app.secret_key = os.environ.get('SECRET_KEY', secrets.token_hex(32))
 CORS(app)
 
+# Templates link CSS/JS through asset_url() so built assets get hashed URLs
+app.jinja_env.globals['asset_url'] = asset_url
+
+# orjson for jsonify (datetimes serialize as ISO 8601) and gzip/brotli responses
+install_response_encoding(app)
+
 # File upload configuration
 UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'uploads')
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp', 'pdf'}
@@ -47,12 +82,174 @@ app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE
 # Create uploads folder if it doesn't exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# Token for operational endpoints (sent as X-Admin-Token); unset disables them
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+
+# Behind a reverse proxy (Cloud Run, nginx) take the client IP from X-Forwarded-For
+TRUST_PROXY_HEADERS = os.environ.get('TRUST_PROXY_HEADERS', 'false').lower() == 'true'
+
+# Tables and columns added on top of the base schema
+ensure_schema()
+
+# Load the medicine autocomplete index in the background
+start_background_refresh()
+
+# Server-side medication reminders (due events and missed-slot marking)
+start_scheduler()
+
 
 def allowed_file(filename):
     """Check if file extension is allowed."""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+def get_ai_profile(user_id):
+    """Build the profile dict SageAI uses for personalized responses."""
+    return build_ai_profile(user_id, session.get('user_name', 'there'))
+
+
+def build_ai_profile(user_id, name):
+    """get_ai_profile without the Flask session (shared with the ASGI routes)."""
+    user_profile = {'name': name}
+    profile = get_health_profile(user_id)
+    if profile:
+        user_profile['conditions'] = profile.get('conditions', [])
+        user_profile['allergies'] = profile.get('allergies', '')
+        user_profile['medications'] = profile.get('medications', '')
+        user_profile['medication_checks'] = cached_lookup(
+            'medication_checks', user_id, lambda: _medication_checks(user_id, profile)
+        )
+    return user_profile
+
+
+def _medication_checks(user_id, profile):
+    """Allergy and duplicate-ingredient findings for the user's medicines (None, uncached, until the index loads)."""
+    names = get_active_medication_names(user_id)
+    names += [m for m in re.split(r'[,;\n]', profile.get('medications') or '') if m.strip()]
+    return check_medications(names, profile.get('allergies'))
+
+
+def is_admin_request():
+    """Check the X-Admin-Token header against ADMIN_TOKEN."""
+    token = request.headers.get('X-Admin-Token', '')
+    return bool(ADMIN_TOKEN) and secrets.compare_digest(token, ADMIN_TOKEN)
+
+
+def client_ip():
+    """Best-effort client address for rate limiting."""
+    if TRUST_PROXY_HEADERS and request.access_route:
+        return request.access_route[0]
+    return request.remote_addr
+
+
+def rate_limited(rule, email=None, template=None, **context):
+    """
+    Apply a rate limit rule to this request (keyed by email, IP and user).
+    Returns a 429 response with Retry-After if the caller is over the limit,
+    rendered from `template` for form pages, else JSON; otherwise None.
+    """
+    retry_after = check_rate_limit(rule, email=email, ip=client_ip(), user=session.get('user_id'))
+    if not retry_after:
+        return None
+    
+    error = f"Too many attempts. Please try again in {retry_after} seconds."
+    if template:
+        response = make_response(render_template(template, error=error, **context), 429)
+    else:
+        response = make_response(jsonify({'error': error}), 429)
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+@app.errorhandler(PasswordHasherBusy)
+def password_hasher_busy(e):
+    """Signup, password reset and Google sign-in shed while hashing is saturated."""
+    response = make_response("Server is busy, please try again in a moment.", 503)
+    response.headers['Retry-After'] = str(PASSWORD_HASH_RETRY_AFTER)
+    return response
+
+
+@app.errorhandler(LLMOverloaded)
+def llm_overloaded(e):
+    """Chat and upload requests shed by LLM admission control."""
+    response = make_response(jsonify({'error': "Sage is very busy right now. Please try again shortly."}), 503)
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+
+@app.errorhandler(IdempotencyKeyReused)
+def idempotency_key_reused(e):
+    """An Idempotency-Key sent again with a different message or file."""
+    return jsonify({'error': str(e)}), 422
+
+
+# ============== METRICS & TRACING ==============
+
+def _route_label():
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.trace = start_trace(f"{request.method} {_route_label()}")
+
+
+@app.after_request
+def record_response_status(response):
+    g.response_status = response.status_code
+    return response
+
+
+@app.teardown_request
+def record_request_latency(error=None):
+    """Runs even when a view raised, so failed requests are still timed and traced."""
+    status = 500 if error is not None else g.pop('response_status', 500)
+    started = g.pop('request_started', None)
+    if started is not None:
+        REQUEST_SECONDS.observe(time.perf_counter() - started,
+                                route=_route_label(), method=request.method, status=status)
+    attrs = {'error': type(error).__name__} if error is not None else {}
+    finish_trace(g.pop('trace', None), status=status, **attrs)
+
+
+def _labelled(stats, *fields):
+    """{(field,): value} for a labelled gauge, from a stats dict."""
+    return {(field,): stats[field] for field in fields}
+
+
+Gauge('sage_ai_instances', 'SageAI conversation objects held in memory', lambda: len(_sage_instances))
+Gauge('sage_smtp_pool', 'SMTP worker threads and queued emails',
+      lambda: _labelled(get_mail_queue_stats(), 'workers', 'queued'), ('state',))
+Gauge('sage_password_hash_pool', 'bcrypt worker pool load',
+      lambda: _labelled(get_hasher_stats(), 'workers', 'pending'), ('state',))
+Gauge('sage_llm_pool', 'LLM calls in flight and waiting for admission',
+      lambda: _labelled(get_llm_queue_stats(), 'in_flight', 'queue_depth', 'max_concurrent'), ('state',))
+Gauge('sage_cache_entries', 'Entries in each in-process cache',
+      lambda: {(name,): stats['size'] for name, stats in get_cache_stats().items()}, ('cache',))
+Gauge('sage_prompt_cache_entries', 'Cached system prompts', lambda: get_prompt_cache_stats()['cache_size'])
+Gauge('sage_log_queue', 'Log records waiting for the writer thread, and dropped when it was full',
+      lambda: _labelled(get_logging_stats(), 'queued', 'dropped'), ('state',))
+Gauge('sage_reminder_medications', 'Medications scheduled in the reminder wheel',
+      lambda: get_scheduler_stats()['medications'])
+
+
+def is_metrics_request():
+    """Scrapers authenticate with X-Admin-Token or `Authorization: Bearer <ADMIN_TOKEN>`."""
+    if is_admin_request():
+        return True
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    return bool(ADMIN_TOKEN) and scheme.lower() == 'bearer' and secrets.compare_digest(token, ADMIN_TOKEN)
+
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus text exposition of this worker's metrics."""
+    if not is_metrics_request():
+        return jsonify({'error': 'Forbidden'}), 403
+    return app.response_class(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 # ============== PAGE ROUTES ==============
 
 @app.route('/')
@@ -75,8 +272,19 @@ def login():
         if not email or not password:
             return render_template('login.html', error="Please fill all fields")
         
+        limited = rate_limited('login', email=email, template='login.html')
+        if limited:
+            return limited
+        
         # Verify user credentials
-        user = verify_user(email, password)
+        try:
+            user = verify_user(email, password)
+        except PasswordHasherBusy:
+            response = make_response(render_template(
+                'login.html', error="We're handling a lot of sign-ins right now. Please try again in a moment."
+            ), 503)
+            response.headers['Retry-After'] = str(PASSWORD_HASH_RETRY_AFTER)
+            return response
         
         if user:
             # Set session
@@ -134,6 +342,10 @@ def signup():
             'password': password
         }
         
+        limited = rate_limited('otp_send', email=email, template='signup.html')
+        if limited:
+            return limited
+        
         # Send OTP
         success, otp = send_verification_otp(email)
         if success:
@@ -158,16 +370,19 @@ def verify_email():
         if not otp:
             return render_template('verify_email.html', email=email, error="Please enter the OTP")
         
+        # Hash first: if the pool sheds us with a 503, the OTP is still valid for the retry
+        data = session['signup_data']
+        hashed_password = hash_password(data['password'])
+        
         # Verify OTP
         valid, message = verify_otp(email, otp, "verification")
         
         if valid:
             # Create user
-            data = session['signup_data']
             user_id = create_user(
                 data['name'], 
                 data['email'], 
-                data['password'], 
+                hashed_password, 
                 data.get('gender'), 
                 data.get('dob') if data.get('dob') else None
             )
@@ -197,6 +412,10 @@ def resend_otp():
         return jsonify({'error': 'No signup in progress'}), 400
     
     email = session['signup_data']['email']
+    limited = rate_limited('otp_send', email=email)
+    if limited:
+        return limited
+    
     success, otp = send_verification_otp(email)
     
     if success:
@@ -214,6 +433,10 @@ def forgot_password():
         if not email:
             return render_template('forgot_password.html', error="Please enter your email")
         
+        limited = rate_limited('otp_send', email=email, template='forgot_password.html')
+        if limited:
+            return limited
+        
         # Check if user exists
         user = get_user_by_email(email)
         if not user:
@@ -252,12 +475,15 @@ def reset_password():
         if len(new_password) < 6:
             return render_template('reset_password.html', email=email, error="Password must be at least 6 characters")
         
+        # Hash first: if the pool sheds us with a 503, the OTP is still valid for the retry
+        hashed_password = hash_password(new_password)
+        
         # Verify OTP
         valid, message = verify_otp(email, otp, "reset")
         
         if valid:
             # Update password
-            success = update_user_password(email, new_password)
+            success = update_user_password(email, hashed_password)
             if success:
                 session.pop('reset_email', None)
                 return redirect(url_for('login', success="Password reset successful. Please login."))
@@ -276,6 +502,10 @@ def resend_reset_otp():
         return jsonify({'error': 'No reset in progress'}), 400
     
     email = session['reset_email']
+    limited = rate_limited('otp_send', email=email)
+    if limited:
+        return limited
+    
     success, otp = send_password_reset_otp(email)
     
     if success:
@@ -404,45 +634,54 @@ def api_chat():
     if not message:
         return jsonify({'error': 'No message provided'}), 400
     
-    # Get or create chat session
-    is_new_session = False
-    if not session.get('current_session_id'):
-        is_new_session = True
-        # Create new session with temporary title
-        session_id = create_chat_session(session['user_id'], "New Chat")
-        session['current_session_id'] = session_id
-    else:
-        session_id = session['current_session_id']
-    
-    # Save user message to database
-    save_chat_message(session['user_id'], message, 'user', session_id)
-    
-    # Get user profile for personalized responses
-    user_profile = {
-        'name': session.get('user_name', 'there')
-    }
-    profile = get_health_profile(session['user_id'])
-    if profile:
-        user_profile['conditions'] = profile.get('conditions', [])
-        user_profile['allergies'] = profile.get('allergies', '')
-        user_profile['medications'] = profile.get('medications', '')
-    
-    # Get AI instance and response
-    sage = get_sage_instance(session['user_id'], user_profile)
-    response = sage.chat(message)
-    
-    # Save AI response to database
-    save_chat_message(session['user_id'], response, 'sage', session_id)
-    
-    # Generate meaningful title for new sessions
-    if is_new_session:
-        title = generate_chat_title(message)
-        update_session_title(session_id, title)
+    # Retries carrying the same Idempotency-Key reuse the first attempt's reply
+    key = idempotency_key(session['user_id'], 'chat', request.headers.get('Idempotency-Key'))
+    payload, status, replayed = run_once(key, lambda: _chat_turn(message), request_fingerprint(message))
+    if replayed:
+        session['current_session_id'] = payload['session_id']
+    return idempotent_response(payload, status, replayed)
+
+
+def _chat_turn(message):
+    """Save the message, get Sage's reply and save it. Returns (payload, status)."""
+    # Wait for a fair share of LLM capacity before writing anything
+    with admit(session['user_id']):
+        # Get or create chat session
+        is_new_session = False
+        if not session.get('current_session_id'):
+            is_new_session = True
+            # Create new session with temporary title
+            session_id = create_chat_session(session['user_id'], "New Chat")
+            session['current_session_id'] = session_id
+        else:
+            session_id = session['current_session_id']
+        
+        # Save user message to database
+        save_chat_message(session['user_id'], message, 'user', session_id)
+        
+        # Get user profile for personalized responses
+        user_profile = get_ai_profile(session['user_id'])
+        
+        # Get AI instance and response
+        sage = get_sage_instance(session['user_id'], user_profile)
+        response = sage.chat(message)
+        
+        # Save AI response to database
+        save_chat_message(session['user_id'], response, 'sage', session_id)
+        
+        # Generate meaningful title for new sessions
+        if is_new_session:
+            title = generate_chat_title(message)
+            update_session_title(session_id, title)
     
-    return jsonify({
-        'response': response,
-        'session_id': session_id
-    })
+    return {'response': response, 'session_id': session_id}, 200
+
+
+def idempotent_response(payload, status, replayed):
+    response = make_response(jsonify(payload), status)
+    if replayed:
+        response.headers['Idempotent-Replayed'] = 'true'
+    return response
 
 
 @app.route('/api/profile', methods=['GET', 'POST'])
@@ -475,11 +714,14 @@ def api_chat_history():
         return jsonify({'error': 'Unauthorized'}), 401
     
     if request.method == 'DELETE':
-        # Clear database history
-        success = clear_chat_history(session['user_id'])
+        # Clear database history in the background, up to the newest message right now
+        max_id = get_chat_delete_bound(session['user_id'])
+        if max_id is None:
+            return jsonify({'success': False, 'error': 'Database error'}), 500
+        job_id = start_clear_history_job(session['user_id'], max_id)
         # Clear AI conversation memory
         clear_sage_instance(session['user_id'])
-        return jsonify({'success': success})
+        return jsonify({'success': True, 'job_id': job_id}), 202
     
     history = get_chat_history(session['user_id'])
     return jsonify(history)
@@ -508,10 +750,10 @@ def api_get_sessions():
     
     sessions = get_chat_sessions(session['user_id'])
     
-    # Convert datetime to string
-    for s in sessions:
-        s['created_at'] = s['created_at'].isoformat() if s['created_at'] else None
-        s['updated_at'] = s['updated_at'].isoformat() if s['updated_at'] else None
+    # Hide sessions that are still being deleted in the background
+    deleting = pending_session_deletes(session['user_id'])
+    if deleting:
+        sessions = [s for s in sessions if s['id'] not in deleting]
     
     return jsonify({
         'sessions': sessions,
@@ -526,33 +768,51 @@ def api_session(session_id):
         return jsonify({'error': 'Unauthorized'}), 401
     
     if request.method == 'DELETE':
-        success = delete_chat_session(session_id, session['user_id'])
+        max_id = get_chat_delete_bound(session['user_id'], session_id)
+        if max_id is None:
+            return jsonify({'success': False})
+        job_id = start_delete_session_job(session['user_id'], session_id, max_id)
         if session.get('current_session_id') == session_id:
             session.pop('current_session_id', None)
-        return jsonify({'success': success})
-    
-    # GET - load session messages
-    messages = get_chat_history(session['user_id'], session_id)
+        return jsonify({'success': True, 'job_id': job_id}), 202
     
-    # Set as current session
+    # GET - switch to this session
     session['current_session_id'] = session_id
     
-    # Clear and reload AI memory with this conversation
-    clear_sage_instance(session['user_id'])
-    sage = get_sage_instance(session['user_id'])
+    # Rehydrate AI memory with only the tail the model will actually see
+    tail = get_chat_history_tail(session['user_id'], session_id, HISTORY_MAX_MESSAGES)
+    switch_sage_session(session['user_id'], tail)
+    
+    # Latest page for the UI; older pages come from /api/sessions/<id>/messages
+    messages, next_before_id = get_chat_history_page(session['user_id'], session_id)
+    
+    return jsonify({'messages': messages, 'next_before_id': next_before_id})
+
+
+@app.route('/api/sessions/<int:session_id>/messages', methods=['GET'])
+def api_session_messages(session_id):
+    """Get a page of messages for a chat session (newest page first)."""
+    if not session.get('user_id'):
+        return jsonify({'error': 'Unauthorized'}), 401
     
-    # Rebuild AI conversation history
-    for msg in messages:
-        sage.conversation_history.append({
-            "role": "user" if msg['sender'] == 'user' else "assistant",
-            "content": msg['message']
-        })
+    before_id = request.args.get('before', type=int)
+    limit = max(1, min(request.args.get('limit', 50, type=int), 200))
     
-    # Convert datetime
-    for msg in messages:
-        msg['created_at'] = msg['created_at'].isoformat() if msg['created_at'] else None
+    messages, next_before_id = get_chat_history_page(session['user_id'], session_id, limit, before_id)
     
-    return jsonify({'messages': messages})
+    return jsonify({'messages': messages, 'next_before_id': next_before_id})
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def api_job_status(job_id):
+    """Get progress of a background delete job."""
+    if not session.get('user_id'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    job = get_job(job_id, session['user_id'])
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
 
 
 @app.route('/api/upload', methods=['POST'])
@@ -573,55 +833,58 @@ def api_upload():
     if not allowed_file(file.filename):
         return jsonify({'error': 'File type not allowed. Use PNG, JPG, GIF, WEBP, or PDF'}), 400
     
-    try:
-        # Read file content
-        file_content = file.read()
-        filename = secure_filename(file.filename)
-        file_ext = filename.rsplit('.', 1)[1].lower()
-        
-        # Save file
-        user_folder = os.path.join(app.config['UPLOAD_FOLDER'], str(session['user_id']))
-        os.makedirs(user_folder, exist_ok=True)
-        
-        # Generate unique filename
-        unique_filename = f"{secrets.token_hex(8)}_{filename}"
-        file_path = os.path.join(user_folder, unique_filename)
-        
-        with open(file_path, 'wb') as f:
-            f.write(file_content)
-        
-        # Save user message to database
-        save_chat_message(session['user_id'], f"[Uploaded: {filename}] {message}", 'user')
-        
-        # Get user profile
-        user_profile = {'name': session.get('user_name', 'there')}
-        profile = get_health_profile(session['user_id'])
-        if profile:
-            user_profile['conditions'] = profile.get('conditions', [])
-            user_profile['allergies'] = profile.get('allergies', '')
-            user_profile['medications'] = profile.get('medications', '')
-        
-        # Get AI instance
-        sage = get_sage_instance(session['user_id'], user_profile)
-        
-        # Analyze based on file type
-        if file_ext == 'pdf':
-            response = sage.chat(f"[User uploaded a PDF document: {filename}] {message}\n\nNote: I cannot read PDF contents directly. Please describe what's in the document or copy-paste the relevant text, and I'll help you understand it.")
-        else:
-            # For images, use Claude's vision capability
-            response = sage.analyze_image(file_content, file_ext, message)
-        
-        # Save AI response
-        save_chat_message(session['user_id'], response, 'sage')
-        
-        return jsonify({
-            'response': response,
-            'filename': unique_filename
-        })
-        
-    except Exception as e:
-        print(f"Upload error: {e}")
-        return jsonify({'error': 'Failed to process file'}), 500
+    # Read file content
+    file_content = file.read()
+    
+    key = idempotency_key(session['user_id'], 'upload', request.headers.get('Idempotency-Key'))
+    fingerprint = request_fingerprint(file.filename, message, file_content)
+    payload, status, replayed = run_once(key, lambda: _upload_turn(file.filename, file_content, message), fingerprint)
+    return idempotent_response(payload, status, replayed)
+
+
+def _upload_turn(original_filename, file_content, message):
+    """Store the upload and have Sage analyze it. Returns (payload, status)."""
+    cost = CHAT_COST if original_filename.rsplit('.', 1)[1].lower() == 'pdf' else IMAGE_COST
+    with admit(session['user_id'], cost):
+        try:
+            filename = secure_filename(original_filename)
+            file_ext = filename.rsplit('.', 1)[1].lower()
+            
+            # Save file
+            user_folder = os.path.join(app.config['UPLOAD_FOLDER'], str(session['user_id']))
+            os.makedirs(user_folder, exist_ok=True)
+            
+            # Generate unique filename
+            unique_filename = f"{secrets.token_hex(8)}_{filename}"
+            file_path = os.path.join(user_folder, unique_filename)
+            
+            with open(file_path, 'wb') as f:
+                f.write(file_content)
+            
+            # Save user message to database
+            save_chat_message(session['user_id'], f"[Uploaded: {filename}] {message}", 'user')
+            
+            # Get user profile
+            user_profile = get_ai_profile(session['user_id'])
+            
+            # Get AI instance
+            sage = get_sage_instance(session['user_id'], user_profile)
+            
+            # Analyze based on file type
+            if file_ext == 'pdf':
+                response = sage.chat(f"[User uploaded a PDF document: {filename}] {message}\n\nNote: I cannot read PDF contents directly. Please describe what's in the document or copy-paste the relevant text, and I'll help you understand it.")
+            else:
+                # For images, use Claude's vision capability
+                response = sage.analyze_image(file_content, file_ext, message)
+            
+            # Save AI response
+            save_chat_message(session['user_id'], response, 'sage')
+            
+            return {'response': response, 'filename': unique_filename}, 200
+            
+        except Exception as e:
+            logger.error("Upload error: %s", e)
+            return {'error': 'Failed to process file'}, 500
 
 
 @app.route('/uploads/<int:user_id>/<filename>')
@@ -634,6 +897,12 @@ def serve_upload(user_id, filename):
     return send_from_directory(user_folder, filename)
 
 
+@app.route('/assets/<path:filename>')
+def hashed_asset(filename):
+    """Serve fingerprinted static files (see build_assets.py) with immutable caching."""
+    return send_asset(filename)
+
+
 @app.route('/health')
 def health():
     return jsonify({'status': 'healthy', 'service': 'sage-backend'})
@@ -724,7 +993,7 @@ def google_callback():
             return redirect(url_for('google_complete_profile'))
             
     except Exception as e:
-        print(f"Google OAuth error: {e}")
+        logger.error("Google OAuth error: %s", e)
         return redirect(url_for('login', error='Authentication failed'))
 
 # ============== MEDICINE REMINDER ROUTES ==============
@@ -746,7 +1015,25 @@ def api_search_medicines():
     if len(query) < 2:
         return jsonify({'medicines': []})
     
-    connection = get_connection()
+    # mode: 'auto' (default) retries with typo tolerance when nothing matches
+    mode = request.args.get('mode', 'auto')
+    if mode not in ('auto', 'exact', 'fuzzy'):
+        mode = 'auto'
+    
+    # Served from the in-memory index; SQL is only a fallback while it loads
+    found = cached_search_medicines(query, mode=mode)
+    if found is not None:
+        medicines, fuzzy, etag = found
+        if request.if_none_match.contains(etag):
+            response = app.response_class(status=304)
+        else:
+            response = jsonify({'medicines': medicines, 'fuzzy': fuzzy})
+        # The catalogue is the same for every user, so shared caches may store it
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'public, max-age=300'
+        return response
+    
+    connection = get_connection(read_only=True)
     if not connection:
         return jsonify({'medicines': [], 'error': 'Database error'}), 500
     
@@ -769,13 +1056,25 @@ def api_search_medicines():
         return jsonify({'medicines': medicines})
         
     except Exception as e:
-        print(f"Medicine search error: {e}")
+        logger.error("Medicine search error: %s", e)
         return jsonify({'medicines': [], 'error': str(e)}), 500
     finally:
         cursor.close()
         connection.close()
 
 
+@app.route('/admin/medicines/reindex', methods=['POST'])
+def admin_reindex_medicines():
+    """Rebuild the in-memory medicine search index without a restart."""
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
+    
+    count = refresh_medicine_index()
+    if count is None:
+        return jsonify({'error': 'Failed to load medicines'}), 500
+    return jsonify({'success': True, 'medicines': count})
+
+
 @app.route('/api/medications', methods=['GET', 'POST'])
 def api_medications():
     """Get all user medications or add a new one."""
@@ -811,11 +1110,14 @@ def api_medications():
             """
             cursor.execute(query, (user_id, medicine_name, dosage, frequency, json.dumps(times), notes))
             connection.commit()
+            mark_user_write(user_id)
+            invalidate('medication_checks', user_id)
+            reschedule_medication(cursor.lastrowid)
             
             return jsonify({'success': True, 'id': cursor.lastrowid})
             
         except Exception as e:
-            print(f"Add medication error: {e}")
+            logger.error("Add medication error: %s", e)
             return jsonify({'error': str(e)}), 500
         finally:
             cursor.close()
@@ -848,13 +1150,11 @@ def api_medications():
                     med['times'] = []
             else:
                 med['times'] = []
-            if med['created_at']:
-                med['created_at'] = med['created_at'].isoformat()
         
         return jsonify({'medications': medications})
         
     except Exception as e:
-        print(f"Get medications error: {e}")
+        logger.error("Get medications error: %s", e)
         return jsonify({'medications': [], 'error': str(e)}), 500
     finally:
         cursor.close()
@@ -884,6 +1184,9 @@ def api_medication(med_id):
         if request.method == 'DELETE':
             cursor.execute("DELETE FROM user_medications WHERE id = %s AND user_id = %s", (med_id, user_id))
             connection.commit()
+            mark_user_write(user_id)
+            invalidate('medication_checks', user_id)
+            unschedule_medication(med_id)
             return jsonify({'success': True})
         
         elif request.method == 'PUT':
@@ -905,6 +1208,9 @@ def api_medication(med_id):
                 user_id
             ))
             connection.commit()
+            mark_user_write(user_id)
+            invalidate('medication_checks', user_id)
+            reschedule_medication(med_id)
             return jsonify({'success': True})
         
         else:  # GET
@@ -920,46 +1226,170 @@ def api_medication(med_id):
             return jsonify(med)
         
     except Exception as e:
-        print(f"Medication operation error: {e}")
+        logger.error("Medication operation error: %s", e)
         return jsonify({'error': str(e)}), 500
     finally:
         cursor.close()
         connection.close()
 
+
+def user_today(user_id):
+    """
+    Today in the user's stored timezone, the same date the reminder
+    scheduler logs their missed slots under (server date if unknown).
+    """
+    user = get_user_by_id(user_id)
+    return local_today(user.get('timezone') if user else None)
+
+
 @app.route('/api/medications/log', methods=['POST'])
 def api_log_medication():
     """Log a medication as taken or missed for a specific time slot."""
     if not session.get('user_id'):
         return jsonify({'error': 'Unauthorized'}), 401
     
-    data = request.json
-    med_id = data.get('medication_id')
-    time_slot = data.get('time_slot')
-    status = data.get('status') # 'taken' or 'missed'
+    today = user_today(session['user_id']).isoformat()
+    
+    try:
+        med_id, log_date, time_slot, status = parse_slot_log(request.json, today, allow_date=False)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
+    # Same path as the batch endpoint so adherence rollups stay in step
+    if log_medication_slots([(session['user_id'], med_id, log_date, time_slot, status)]) is None:
+        return jsonify({'error': 'Database error'}), 500
+    return jsonify({'success': True})
+
+
+MAX_BATCH_LOGS = 200
+LOG_STATUSES = ('taken', 'missed')
+_TIME_SLOT_RE = re.compile(r'^(\d{1,2}):(\d{2})$')
+
+
+def parse_slot_log(log, default_date, allow_date=True):
+    """
+    Validate one client slot log and normalize it to
+    (medication_id, 'YYYY-MM-DD', 'HH:MM', status), so equal slots always
+    compare equal in log_medication_slots. Raises ValueError with a message.
+    """
     from datetime import date
-    today = date.today().isoformat()
     
-    connection = get_connection()
-    if not connection:
+    if not isinstance(log, dict):
+        raise ValueError('Each log must be an object')
+    if log.get('status') not in LOG_STATUSES:
+        raise ValueError('status must be taken or missed')
+    
+    med_id = log.get('medication_id')
+    if isinstance(med_id, bool) or not str(med_id or '').isdigit() or int(med_id) == 0:
+        raise ValueError('medication_id must be a positive integer')
+    
+    log_date = default_date
+    if allow_date and log.get('log_date') is not None:
+        try:
+            log_date = date.fromisoformat(str(log['log_date'])).isoformat()
+        except ValueError:
+            raise ValueError('log_date must be YYYY-MM-DD')
+    
+    match = _TIME_SLOT_RE.match(str(log.get('time_slot') or ''))
+    if not match or int(match.group(1)) > 23 or int(match.group(2)) > 59:
+        raise ValueError('time_slot must be HH:MM')
+    time_slot = f"{int(match.group(1)):02d}:{match.group(2)}"
+    
+    return int(med_id), log_date, time_slot, log['status']
+
+
+@app.route('/api/medications/log/batch', methods=['POST'])
+def api_log_medications_batch():
+    """Log many medication slots in one request (one multi-row upsert)."""
+    if not session.get('user_id'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    today = user_today(session['user_id']).isoformat()
+    
+    logs = (request.json or {}).get('logs', [])
+    if not isinstance(logs, list) or len(logs) > MAX_BATCH_LOGS:
+        return jsonify({'error': f'logs must be a list of at most {MAX_BATCH_LOGS} entries'}), 400
+    
+    entries = []
+    for log in logs:
+        try:
+            entries.append((session['user_id'],) + parse_slot_log(log, today))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    
+    changed = log_medication_slots(entries)
+    if changed is None:
         return jsonify({'error': 'Database error'}), 500
-        
-    try:
-        cursor = connection.cursor()
-        query = """
-            INSERT INTO medication_logs (user_id, medication_id, log_date, time_slot, status)
-            VALUES (%s, %s, %s, %s, %s)
-            ON DUPLICATE KEY UPDATE status = %s
-        """
-        cursor.execute(query, (session['user_id'], med_id, today, time_slot, status, status))
-        connection.commit()
-        return jsonify({'success': True})
-    except Exception as e:
-        print(f"Log medication error: {e}")
-        return jsonify({'error': str(e)}), 500
-    finally:
-        cursor.close()
-        connection.close()
+    return jsonify({'success': True, 'changed': changed})
+
+
+@app.route('/api/medications/adherence', methods=['GET'])
+def api_medication_adherence():
+    """Get daily adherence (scheduled/taken/missed) from the rollup table."""
+    if not session.get('user_id'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    from datetime import timedelta
+    days = max(1, min(request.args.get('days', 30, type=int), 366))
+    end = user_today(session['user_id'])
+    start = end - timedelta(days=days - 1)
+    
+    rows = get_adherence(session['user_id'], start.isoformat(), end.isoformat())
+    if rows is None:
+        return jsonify({'adherence': [], 'error': 'Database error'}), 500
+    
+    return jsonify({'start': start.isoformat(), 'end': end.isoformat(), 'adherence': rows})
+
+
+@app.route('/admin/rate-limits')
+def admin_rate_limits():
+    """Allowed and shed call counters per rate limit rule."""
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
+    return jsonify(get_rate_limit_stats())
+
+
+@app.route('/admin/llm-queue')
+def admin_llm_queue():
+    """LLM admission control: in-flight calls, queue depth and wait times."""
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
+    return jsonify(get_llm_queue_stats())
+
+
+@app.route('/admin/profile', methods=['GET', 'POST'])
+def admin_profile():
+    """
+    POST ?seconds=N samples this worker's stacks for N seconds into a
+    collapsed-stack file for flamegraph.pl; GET reports the last run.
+    """
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
+    
+    if request.method == 'GET':
+        return jsonify(get_profile_status())
+    
+    status = start_profile(request.args.get('seconds', 30, type=int))
+    if status is None:
+        return jsonify({'error': 'A profile is already running', 'profile': get_profile_status()}), 409
+    return jsonify(status), 202
+
+
+@app.route('/admin/profile/<path:filename>')
+def admin_profile_download(filename):
+    """Download a finished profile written by /admin/profile."""
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
+    return send_from_directory(PROFILE_DIR, filename, as_attachment=True, mimetype='text/plain')
+
+
+@app.route('/admin/adherence/rebuild', methods=['POST'])
+def admin_rebuild_adherence():
+    """Backfill adherence rollups from the raw medication logs."""
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
+    
+    return jsonify({'success': rebuild_adherence_rollups()})
 
 @app.route('/api/medications/logs/today', methods=['GET'])
 def api_get_today_logs():
@@ -967,8 +1397,7 @@ def api_get_today_logs():
     if not session.get('user_id'):
         return jsonify({'error': 'Unauthorized'}), 401
     
-    from datetime import date
-    today = date.today().isoformat()
+    today = user_today(session['user_id']).isoformat()
     
     connection = get_connection()
     if not connection:
@@ -981,12 +1410,54 @@ def api_get_today_logs():
         logs = cursor.fetchall()
         return jsonify({'logs': logs})
     except Exception as e:
-        print(f"Get logs error: {e}")
+        logger.error("Get logs error: %s", e)
         return jsonify({'logs': [], 'error': str(e)}), 500
     finally:
         cursor.close()
         connection.close()
 
+@app.route('/api/medications/dashboard', methods=['GET'])
+def api_medications_dashboard():
+    """Get medications with today's slot statuses in one response (supports ETags)."""
+    if not session.get('user_id'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    today = user_today(session['user_id']).isoformat()
+    
+    medications = get_medication_dashboard(session['user_id'], today)
+    if medications is None:
+        return jsonify({'medications': [], 'error': 'Database error'}), 500
+    
+    payload = {'date': today, 'medications': medications}
+    body = app.json.dumps(payload, sort_keys=True)
+    etag = hashlib.sha1(body.encode('utf-8')).hexdigest()[:20]
+    
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = app.response_class(body, mimetype='application/json')
+    # Per-user data: browsers may keep it but must revalidate every time
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@app.route('/api/medications/due', methods=['GET'])
+def api_due_medications():
+    """
+    Get (and clear) due-dose events fired by the reminder scheduler.
+    ?tz= is the browser's IANA timezone, which reminders are scheduled in;
+    'scheduler' is false until it is known, and the page checks locally.
+    """
+    if not session.get('user_id'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    scheduled = reminder_scheduler_running() and set_user_timezone(session['user_id'], request.args.get('tz', ''))
+    return jsonify({
+        'scheduler': scheduled,
+        'events': pop_due_events(session['user_id'])
+    })
+
 if __name__ == '__main__':
     print("\n" + "="*50)
     print("  🌿 SAGE - AI Healthcare Chatbot")
@@ -0,0 +1,277 @@
+"""
+Sage - ASGI Entry Point
+Serves the long-running LLM routes (/api/chat, /api/upload) as native
+async views - AsyncAnthropic for the model call, aiomysql for their
+writes - so hundreds of in-flight chats can wait on Claude in one
+process without holding a thread each. Every other route is the
+unchanged Flask app, mounted through a2wsgi's WSGI adapter on a pool of
+WSGI_THREADS threads (like gunicorn --threads), and both share Flask's
+signed session cookie. The embedding model is loaded at startup so the
+first chat doesn't block the event loop.
+
+Run with:
+    uvicorn backend.asgi:app --host 0.0.0.0 --port 8080
+"""
+
+import asyncio
+import contextlib
+import os
+import secrets
+import sys
+import time
+
+from a2wsgi import WSGIMiddleware
+from itsdangerous import BadSignature
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+from werkzeug.utils import secure_filename
+
+# Add backend directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app import app as flask_app, build_ai_profile, allowed_file, MAX_FILE_SIZE
+from async_database import create_chat_session, save_chat_message, update_session_title, close_pool, get_pool_stats
+from sage_ai import get_sage_instance, agenerate_chat_title, warm_up_engine
+from llm_scheduler import admit_async, LLMOverloaded, CHAT_COST, IMAGE_COST
+from idempotency import (idempotency_key, request_fingerprint, run_once_async,
+                         IdempotencyKeyReused, IdempotentRequestInterrupted)
+from metrics import Gauge, REQUEST_SECONDS
+from tracing import start_trace, finish_trace
+from logs import get_logger
+
+logger = get_logger(__name__)
+
+WSGI_THREADS = int(os.environ.get('WEB_THREADS', 8))  # threads serving the mounted Flask routes
+
+_session_interface = flask_app.session_interface
+_session_serializer = _session_interface.get_signing_serializer(flask_app)
+SESSION_COOKIE_NAME = flask_app.config['SESSION_COOKIE_NAME']
+
+
+# ============== FLASK SESSION COMPATIBILITY ==============
+
+def load_session(request):
+    """Decode Flask's session cookie; an invalid or missing cookie is an empty session."""
+    cookie = request.cookies.get(SESSION_COOKIE_NAME)
+    if not cookie or _session_serializer is None:
+        return {}
+    try:
+        max_age = int(flask_app.permanent_session_lifetime.total_seconds())
+        return dict(_session_serializer.loads(cookie, max_age=max_age))
+    except BadSignature:
+        return {}
+
+
+def save_session(response, data):
+    """Write the session back in the same format and with the same cookie flags as Flask."""
+    response.set_cookie(
+        SESSION_COOKIE_NAME,
+        _session_serializer.dumps(data),
+        path=_session_interface.get_cookie_path(flask_app),
+        domain=_session_interface.get_cookie_domain(flask_app),
+        secure=_session_interface.get_cookie_secure(flask_app),
+        httponly=_session_interface.get_cookie_httponly(flask_app),
+        samesite=_session_interface.get_cookie_samesite(flask_app),
+    )
+
+
+def overloaded_response(e):
+    """Same 503 the Flask routes return when LLM admission control sheds a request."""
+    return JSONResponse({'error': "Sage is very busy right now. Please try again shortly."},
+                        status_code=503, headers={'Retry-After': str(e.retry_after)})
+
+
+# ============== METRICS & TRACING ==============
+
+def timed_route(path, endpoint, methods):
+    """Route that records latency and a request trace like the Flask routes."""
+    async def view(request):
+        started = time.perf_counter()
+        trace = start_trace(f"{request.method} {path}")
+        status = 500
+        try:
+            response = await endpoint(request)
+            status = response.status_code
+            return response
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - started,
+                                    route=path, method=request.method, status=status)
+            finish_trace(trace, status=status)
+    return Route(path, view, methods=methods)
+
+
+def _async_pool_gauge():
+    stats = get_pool_stats()
+    if stats is None:
+        return {}
+    return {('size',): stats['size'], ('free',): stats['free'], ('max_size',): stats['max_size']}
+
+
+Gauge('sage_async_db_pool', 'aiomysql connections used by the async routes', _async_pool_gauge, ('state',))
+
+
+# ============== ASYNC API ROUTES ==============
+
+async def api_chat(request):
+    """Handle chat messages with AI."""
+    session = load_session(request)
+    user_id = session.get('user_id')
+    if not user_id:
+        return JSONResponse({'error': 'Unauthorized'}, status_code=401)
+    
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    message = (data or {}).get('message')
+    
+    if not message:
+        return JSONResponse({'error': 'No message provided'}, status_code=400)
+    
+    key = idempotency_key(user_id, 'chat', request.headers.get('Idempotency-Key'))
+    result, payload = await run_idempotent(key, lambda: _chat_turn(session, message), request_fingerprint(message))
+    if payload is None:
+        return result
+    
+    if session.get('current_session_id') != payload['session_id']:
+        session['current_session_id'] = payload['session_id']
+        save_session(result, session)
+    return result
+
+
+async def _chat_turn(session, message):
+    """Save the message, get Sage's reply and save it. Returns (payload, status)."""
+    user_id = session['user_id']
+    async with admit_async(user_id):
+        # Get or create chat session
+        is_new_session = False
+        session_id = session.get('current_session_id')
+        if not session_id:
+            is_new_session = True
+            session_id = await create_chat_session(user_id, "New Chat")
+        
+        await save_chat_message(user_id, message, 'user', session_id)
+        
+        # Profile reads are cached; the embedding lookup runs off the event loop inside achat
+        user_profile = await asyncio.to_thread(build_ai_profile, user_id, session.get('user_name', 'there'))
+        sage = await asyncio.to_thread(get_sage_instance, user_id, user_profile)
+        response = await sage.achat(message)
+        
+        await save_chat_message(user_id, response, 'sage', session_id)
+        
+        if is_new_session:
+            title = await agenerate_chat_title(message)
+            await update_session_title(session_id, title)
+    
+    return {'response': response, 'session_id': session_id}, 200
+
+
+def idempotent_response(payload, status, replayed):
+    headers = {'Idempotent-Replayed': 'true'} if replayed else None
+    return JSONResponse(payload, status_code=status, headers=headers)
+
+
+async def run_idempotent(key, fn, fingerprint):
+    """run_once_async with its errors mapped to responses. Returns (response, payload)."""
+    try:
+        payload, status, replayed = await run_once_async(key, fn, fingerprint)
+    except LLMOverloaded as e:
+        return overloaded_response(e), None
+    except IdempotencyKeyReused as e:
+        return JSONResponse({'error': str(e)}, status_code=422), None
+    except IdempotentRequestInterrupted as e:
+        return JSONResponse({'error': "The original request was interrupted. Please retry."},
+                            status_code=503, headers={'Retry-After': str(e.retry_after)}), None
+    return idempotent_response(payload, status, replayed), payload
+
+
+async def api_upload(request):
+    """Handle file upload and analyze with AI."""
+    session = load_session(request)
+    user_id = session.get('user_id')
+    if not user_id:
+        return JSONResponse({'error': 'Unauthorized'}, status_code=401)
+    
+    if int(request.headers.get('content-length') or 0) > MAX_FILE_SIZE:
+        return JSONResponse({'error': 'File too large'}, status_code=413)
+    
+    form = await request.form()
+    file = form.get('file')
+    message = form.get('message') or 'Please analyze this image/document.'
+    
+    if file is None or isinstance(file, str):
+        return JSONResponse({'error': 'No file provided'}, status_code=400)
+    
+    if not file.filename:
+        return JSONResponse({'error': 'No file selected'}, status_code=400)
+    
+    if not allowed_file(file.filename):
+        return JSONResponse({'error': 'File type not allowed. Use PNG, JPG, GIF, WEBP, or PDF'}, status_code=400)
+    
+    # Content-Length can be missing (chunked) or cover only part of the body
+    file_content = await file.read(MAX_FILE_SIZE + 1)
+    if len(file_content) > MAX_FILE_SIZE:
+        return JSONResponse({'error': 'File too large'}, status_code=413)
+    
+    key = idempotency_key(user_id, 'upload', request.headers.get('Idempotency-Key'))
+    fingerprint = request_fingerprint(file.filename, message, file_content)
+    result, _ = await run_idempotent(
+        key, lambda: _upload_turn(session, file.filename, file_content, message), fingerprint)
+    return result
+
+
+async def _upload_turn(session, original_filename, file_content, message):
+    """Store the upload and have Sage analyze it. Returns (payload, status)."""
+    user_id = session['user_id']
+    cost = CHAT_COST if original_filename.rsplit('.', 1)[1].lower() == 'pdf' else IMAGE_COST
+    async with admit_async(user_id, cost):
+        try:
+            filename = secure_filename(original_filename)
+            file_ext = filename.rsplit('.', 1)[1].lower()
+            
+            user_folder = os.path.join(flask_app.config['UPLOAD_FOLDER'], str(user_id))
+            unique_filename = f"{secrets.token_hex(8)}_{filename}"
+            await asyncio.to_thread(_write_upload, user_folder, unique_filename, file_content)
+            
+            await save_chat_message(user_id, f"[Uploaded: {filename}] {message}", 'user')
+            
+            user_profile = await asyncio.to_thread(build_ai_profile, user_id, session.get('user_name', 'there'))
+            sage = await asyncio.to_thread(get_sage_instance, user_id, user_profile)
+            
+            if file_ext == 'pdf':
+                response = await sage.achat(f"[User uploaded a PDF document: {filename}] {message}\n\nNote: I cannot read PDF contents directly. Please describe what's in the document or copy-paste the relevant text, and I'll help you understand it.")
+            else:
+                response = await sage.aanalyze_image(file_content, file_ext, message)
+            
+            await save_chat_message(user_id, response, 'sage')
+            
+            return {'response': response, 'filename': unique_filename}, 200
+            
+        except Exception as e:
+            logger.error("Upload error: %s", e)
+            return {'error': 'Failed to process file'}, 500
+
+
+def _write_upload(user_folder, unique_filename, content):
+    os.makedirs(user_folder, exist_ok=True)
+    with open(os.path.join(user_folder, unique_filename), 'wb') as f:
+        f.write(content)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    await asyncio.to_thread(warm_up_engine)
+    yield
+    await close_pool()
+
+
+app = Starlette(
+    routes=[
+        timed_route('/api/chat', api_chat, methods=['POST']),
+        timed_route('/api/upload', api_upload, methods=['POST']),
+        # Page routes and the remaining /api/* routes
+        Mount('/', app=WSGIMiddleware(flask_app, workers=WSGI_THREADS)),
+    ],
+    lifespan=lifespan,
+)
@@ -0,0 +1,60 @@
+"""
+Sage - Static Assets
+Serves the fingerprinted files produced by build_assets.py. Hashed URLs
+never change content, so they are cached as immutable; precompressed
+.br/.gz variants are picked by Accept-Encoding. Before a build has been
+run, asset_url() falls back to the plain /static URL.
+"""
+
+import json
+import mimetypes
+import os
+
+from flask import request, send_from_directory, url_for
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'frontend', 'static')
+STATIC_DIR = os.path.normpath(STATIC_DIR)
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+MANIFEST_PATH = os.path.join(DIST_DIR, 'manifest.json')
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+_manifest = None
+
+
+def get_manifest():
+    """original path -> hashed path, loaded once per process."""
+    global _manifest
+    if _manifest is None:
+        try:
+            with open(MANIFEST_PATH) as f:
+                _manifest = json.load(f)
+        except (OSError, ValueError):
+            _manifest = {}
+    return _manifest
+
+
+def asset_url(filename):
+    """Template helper: hashed URL for a static file, or its /static URL if not built."""
+    hashed = get_manifest().get(filename)
+    if hashed:
+        return url_for('hashed_asset', filename=hashed)
+    return url_for('static', filename=filename)
+
+
+def send_asset(filename):
+    """Serve a hashed asset, preferring a precompressed variant the client accepts."""
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    encoding = None
+    for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if request.accept_encodings[candidate] and os.path.isfile(os.path.join(DIST_DIR, filename + suffix)):
+            encoding = candidate
+            filename += suffix
+            break
+    
+    response = send_from_directory(DIST_DIR, filename, mimetype=mimetype, max_age=IMMUTABLE_MAX_AGE)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    return response
@@ -0,0 +1,114 @@
+"""
+Sage - Async Database Helper
+aiomysql versions of the chat-path helpers used by the ASGI routes.
+Same tables and semantics as database.py, over a shared connection pool
+so an awaiting request never holds a thread.
+"""
+
+import asyncio
+import os
+
+import aiomysql
+
+from database import DB_CONFIG, CLOUD_SQL_CONNECTION_NAME, mark_user_write
+from logs import get_logger
+
+logger = get_logger(__name__)
+
+ASYNC_DB_POOL_SIZE = int(os.environ.get('ASYNC_DB_POOL_SIZE', 20))
+
+_pool = None
+_pool_lock = asyncio.Lock()
+
+
+async def get_pool():
+    """Create the aiomysql pool on first use."""
+    global _pool
+    if _pool is None:
+        async with _pool_lock:
+            if _pool is None:
+                config = {
+                    'host': DB_CONFIG['host'],
+                    'user': DB_CONFIG['user'],
+                    'password': DB_CONFIG['password'],
+                    'db': DB_CONFIG['database'],
+                    'charset': DB_CONFIG['charset'],
+                    'autocommit': True,
+                    'connect_timeout': DB_CONFIG['connect_timeout'],
+                }
+                if CLOUD_SQL_CONNECTION_NAME:
+                    config['unix_socket'] = f'/cloudsql/{CLOUD_SQL_CONNECTION_NAME}'
+                _pool = await aiomysql.create_pool(minsize=1, maxsize=ASYNC_DB_POOL_SIZE, **config)
+    return _pool
+
+
+def get_pool_stats():
+    """Size and idle connections of the pool, or None before first use."""
+    if _pool is None:
+        return None
+    return {'size': _pool.size, 'free': _pool.freesize, 'max_size': _pool.maxsize}
+
+
+async def close_pool():
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        await _pool.wait_closed()
+        _pool = None
+
+
+# ============== CHAT HISTORY OPERATIONS ==============
+
+async def create_chat_session(user_id, title="New Chat"):
+    """Create a new chat session."""
+    try:
+        pool = await get_pool()
+        async with pool.acquire() as connection:
+            async with connection.cursor() as cursor:
+                await cursor.execute(
+                    "INSERT INTO chat_sessions (user_id, title) VALUES (%s, %s)", (user_id, title)
+                )
+                mark_user_write(user_id)
+                return cursor.lastrowid
+    
+    except (aiomysql.Error, OSError) as e:
+        logger.error("Error creating chat session: %s", e)
+        return None
+
+
+async def update_session_title(session_id, title):
+    """Update the title of a chat session."""
+    try:
+        pool = await get_pool()
+        async with pool.acquire() as connection:
+            async with connection.cursor() as cursor:
+                await cursor.execute(
+                    "UPDATE chat_sessions SET title = %s WHERE id = %s", (title[:100], session_id)
+                )
+                return True
+    
+    except (aiomysql.Error, OSError) as e:
+        logger.error("Error updating session title: %s", e)
+        return False
+
+
+async def save_chat_message(user_id, message, sender, session_id=None):
+    """
+    Save a chat message.
+    sender: 'user' or 'sage'
+    """
+    try:
+        pool = await get_pool()
+        async with pool.acquire() as connection:
+            async with connection.cursor() as cursor:
+                await cursor.execute(
+                    """INSERT INTO chat_history (user_id, message, sender, session_id)
+                       VALUES (%s, %s, %s, %s)""",
+                    (user_id, message, sender, session_id)
+                )
+                mark_user_write(user_id)
+                return True
+    
+    except (aiomysql.Error, OSError) as e:
+        logger.error("Error saving chat message: %s", e)
+        return False
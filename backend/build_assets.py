@@ -0,0 +1,112 @@
+"""
+Sage - Static Asset Build
+Minifies frontend/static CSS and JS, writes content-hashed copies to
+frontend/static/dist with .gz and .br (if the brotli package is
+installed) siblings, and records original -> hashed paths in
+dist/manifest.json for the asset_url() template helper.
+
+Usage:
+    python backend/build_assets.py
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+
+try:
+    import brotli
+except ImportError:  # .br files are skipped without it
+    brotli = None
+
+try:
+    import rcssmin
+    import rjsmin
+except ImportError:  # CSS falls back to the conservative minifier below; JS is copied as is
+    rcssmin = rjsmin = None
+
+from assets import STATIC_DIR, DIST_DIR, MANIFEST_PATH
+
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.txt')
+MIN_COMPRESS_BYTES = 256
+
+
+def minify_css(text):
+    if rcssmin:
+        return rcssmin.cssmin(text)
+    text = re.sub(r'/\*.*?\*/', '', text, flags=re.S)
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'\s*([{};,>])\s*', r'\1', text)
+    text = text.replace(';}', '}')
+    return text.strip()
+
+
+def minify_js(text):
+    """
+    Without rjsmin the source is left unchanged: a line-based fallback
+    can't tell code from the inside of multi-line template literals.
+    """
+    if rjsmin:
+        return rjsmin.jsmin(text)
+    return text
+
+
+MINIFIERS = {'.css': minify_css, '.js': minify_js}
+
+
+def build_file(source_path, relative_path):
+    """Minify, hash and compress one file. Returns its hashed relative path."""
+    root, ext = os.path.splitext(relative_path)
+    with open(source_path, 'rb') as f:
+        content = f.read()
+    
+    minify = MINIFIERS.get(ext)
+    if minify:
+        content = minify(content.decode('utf-8')).encode('utf-8')
+    
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    hashed_path = f"{root}.{digest}{ext}"
+    target = os.path.join(DIST_DIR, hashed_path)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, 'wb') as f:
+        f.write(content)
+    
+    if ext in COMPRESSIBLE and len(content) >= MIN_COMPRESS_BYTES:
+        with open(target + '.gz', 'wb') as f:
+            f.write(gzip.compress(content, compresslevel=9, mtime=0))
+        if brotli is not None:
+            with open(target + '.br', 'wb') as f:
+                f.write(brotli.compress(content, quality=11))
+    return hashed_path, len(content)
+
+
+def build():
+    """Rebuild dist/ from scratch. Returns the manifest dict."""
+    shutil.rmtree(DIST_DIR, ignore_errors=True)
+    manifest = {}
+    for directory, subdirs, files in os.walk(STATIC_DIR):
+        subdirs[:] = [d for d in subdirs if os.path.join(directory, d) != DIST_DIR]
+        for name in sorted(files):
+            source_path = os.path.join(directory, name)
+            relative_path = os.path.relpath(source_path, STATIC_DIR).replace(os.sep, '/')
+            hashed_path, size = build_file(source_path, relative_path)
+            manifest[relative_path] = hashed_path
+            print(f"  {relative_path} -> dist/{hashed_path} ({size:,} bytes)")
+    
+    with open(MANIFEST_PATH, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def main():
+    print(f"Building static assets into {DIST_DIR}...")
+    manifest = build()
+    print(f"Done: {len(manifest)} assets{'' if brotli else ' (brotli not installed, gzip only)'}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,259 @@
+"""
+Sage - In-Process Caching
+Bounded TTL cache for hot read paths (user records, health profiles),
+single-flight de-duplication of identical in-flight work, and optional
+Redis pub/sub so invalidations reach every worker
+"""
+
+import copy
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:  # Redis is optional - caches stay process-local without it
+    redis = None
+
+from logs import get_logger
+
+logger = get_logger(__name__)
+
+# Cache configuration from environment
+CACHE_TTL_SECONDS = int(os.environ.get('CACHE_TTL_SECONDS', 300))
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 5000))
+REDIS_URL = os.environ.get('REDIS_URL', '')
+INVALIDATION_CHANNEL = 'sage:cache:invalidate'
+
+_MISSING = object()
+
+
+class _NotFound:
+    def __repr__(self):
+        return 'NOT_FOUND'
+
+
+# Loaders return NOT_FOUND for "no such row" so the miss is cached too
+NOT_FOUND = _NotFound()
+_shared_client = None
+_shared_lock = threading.Lock()
+
+
+def get_shared_client():
+    """Return a Redis client if REDIS_URL is configured, else None."""
+    global _shared_client
+    if not REDIS_URL or redis is None:
+        return None
+    with _shared_lock:
+        if _shared_client is None:
+            try:
+                _shared_client = redis.Redis.from_url(REDIS_URL, socket_timeout=2)
+                _shared_client.ping()
+            except Exception as e:
+                logger.warning("Shared cache unavailable, using local only: %s", e)
+                _shared_client = None
+        return _shared_client
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache where every entry expires after `ttl` seconds.
+    delete() bumps the key's generation; a set() passing the generation
+    read before loading is dropped if the key was deleted in between.
+    """
+
+    def __init__(self, name, ttl=CACHE_TTL_SECONDS, max_entries=CACHE_MAX_ENTRIES):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._clock = itertools.count(1)
+        self._generations = OrderedDict()  # key -> clock value of its last delete
+        self._generation_floor = 0         # newest generation forgotten to bound memory
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if time.monotonic() > expires_at:
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def generation(self, key):
+        """Pass to set() to discard a load that an invalidation overtook."""
+        with self._lock:
+            return self._generations.get(key, self._generation_floor)
+
+    def set(self, key, value, generation=None):
+        with self._lock:
+            if generation is not None and generation != self._generations.get(key, self._generation_floor):
+                return False
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+            self._generations[key] = next(self._clock)
+            self._generations.move_to_end(key)
+            while len(self._generations) > self.max_entries:
+                _, forgotten = self._generations.popitem(last=False)
+                self._generation_floor = max(self._generation_floor, forgotten)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._generations.clear()
+            self._generation_floor = next(self._clock)
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {'size': len(self._data), 'hits': self.hits, 'misses': self.misses}
+
+
+_caches = {}
+
+
+def get_cache(name, ttl=CACHE_TTL_SECONDS, max_entries=CACHE_MAX_ENTRIES):
+    """Get (or create) the named process-wide cache."""
+    if name not in _caches:
+        _caches[name] = TTLCache(name, ttl, max_entries)
+        _start_invalidation_listener()
+    return _caches[name]
+
+
+def get_cache_stats():
+    """Size, hits and misses of every named cache in this process."""
+    return {name: cache.stats() for name, cache in list(_caches.items())}
+
+
+def cached_lookup(cache_name, key, loader):
+    """
+    Read-through helper: return the cached value for key, or call loader()
+    and cache its result. None (a failed load) is not cached; NOT_FOUND is
+    cached and returned as None. Callers get a deep copy, so mutating the
+    result never changes the cached entry. A load overtaken by invalidate()
+    is returned but not cached.
+    """
+    cache = get_cache(cache_name)
+    value = cache.get(key, _MISSING)
+    if value is _MISSING:
+        generation = cache.generation(key)
+        value = loader()
+        if value is None:
+            return None
+        cache.set(key, value, generation)
+    if value is NOT_FOUND:
+        return None
+    return copy.deepcopy(value)
+
+
+def invalidate(cache_name, key):
+    """Drop key locally and broadcast the invalidation to other workers."""
+    if cache_name in _caches:
+        _caches[cache_name].delete(key)
+
+    client = get_shared_client()
+    if client is not None:
+        try:
+            client.publish(INVALIDATION_CHANNEL, f"{cache_name}|{key}")
+        except Exception as e:
+            logger.error("Failed to publish cache invalidation: %s", e)
+
+
+# ============== SINGLE-FLIGHT ==============
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Collapse concurrent calls for the same key into one execution."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.shared = 0
+
+    def do(self, key, fn):
+        """Run fn() once per key at a time; concurrent callers get its result."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+
+# ============== CROSS-WORKER INVALIDATION ==============
+
+_listener_started = False
+
+
+def _start_invalidation_listener():
+    """Subscribe to invalidation broadcasts once per process."""
+    global _listener_started
+    if _listener_started or get_shared_client() is None:
+        return
+    _listener_started = True
+    thread = threading.Thread(target=_listen_for_invalidations, name='cache-invalidation', daemon=True)
+    thread.start()
+
+
+def _listen_for_invalidations():
+    while True:
+        try:
+            pubsub = get_shared_client().pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(INVALIDATION_CHANNEL)
+            for message in pubsub.listen():
+                data = message.get('data')
+                if isinstance(data, bytes):
+                    data = data.decode('utf-8')
+                cache_name, _, key = str(data).partition('|')
+                cache = _caches.get(cache_name)
+                if cache is not None:
+                    # Keys are user ids on the hot paths; try the int form too
+                    cache.delete(key)
+                    if key.isdigit():
+                        cache.delete(int(key))
+        except Exception as e:
+            logger.error("Cache invalidation listener error: %s", e)
+            time.sleep(5)
@@ -0,0 +1,117 @@
+"""
+Sage - Background Delete Jobs
+Runs chat history and session deletes off the request thread so the API
+can answer immediately with a job id and report progress
+"""
+
+import queue
+import threading
+import time
+import uuid
+
+from database import clear_chat_history, delete_chat_session
+from logs import get_logger
+
+logger = get_logger(__name__)
+
+# Finished jobs are kept this long so clients can poll the final status
+JOB_RETENTION_SECONDS = 600
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+_job_queue = queue.Queue()
+_worker_started = False
+
+
+def start_clear_history_job(user_id, max_id):
+    """Queue deletion of a user's chat history up to message max_id. Returns the job id."""
+    return _submit('clear_history', user_id, None, max_id)
+
+
+def start_delete_session_job(user_id, session_id, max_id):
+    """Queue deletion of one chat session and its messages up to max_id. Returns the job id."""
+    return _submit('delete_session', user_id, session_id, max_id)
+
+
+def get_job(job_id, user_id):
+    """Return a snapshot of a job's progress, or None if not found for this user."""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if not job or job['user_id'] != user_id:
+            return None
+        return {k: v for k, v in job.items() if k not in ('user_id', 'max_id')}
+
+
+def pending_session_deletes(user_id):
+    """Session ids of this user that are queued or being deleted."""
+    with _jobs_lock:
+        return {
+            job['session_id'] for job in _jobs.values()
+            if job['user_id'] == user_id and job['kind'] == 'delete_session'
+            and job['status'] in ('queued', 'running')
+        }
+
+
+def _submit(kind, user_id, session_id, max_id):
+    job_id = uuid.uuid4().hex
+    with _jobs_lock:
+        _prune_finished_jobs()
+        _jobs[job_id] = {
+            'id': job_id,
+            'kind': kind,
+            'user_id': user_id,
+            'session_id': session_id,
+            'max_id': max_id,
+            'status': 'queued',
+            'deleted': 0,
+            'created_at': time.time(),
+            'finished_at': None,
+        }
+    _ensure_worker()
+    _job_queue.put(job_id)
+    return job_id
+
+
+def _prune_finished_jobs():
+    cutoff = time.time() - JOB_RETENTION_SECONDS
+    for job_id in [j for j, job in _jobs.items() if job['finished_at'] and job['finished_at'] < cutoff]:
+        del _jobs[job_id]
+
+
+def _ensure_worker():
+    """Start the single delete worker; one at a time keeps lock pressure low."""
+    global _worker_started
+    with _jobs_lock:
+        if _worker_started:
+            return
+        _worker_started = True
+    threading.Thread(target=_worker_loop, name='delete-jobs', daemon=True).start()
+
+
+def _update(job_id, **fields):
+    with _jobs_lock:
+        _jobs[job_id].update(fields)
+
+
+def _worker_loop():
+    while True:
+        job_id = _job_queue.get()
+        with _jobs_lock:
+            job = dict(_jobs[job_id])
+        _update(job_id, status='running')
+        
+        def on_progress(deleted):
+            _update(job_id, deleted=deleted)
+        
+        try:
+            if job['kind'] == 'clear_history':
+                success = clear_chat_history(job['user_id'], job['max_id'], on_progress=on_progress)
+            else:
+                success = delete_chat_session(job['session_id'], job['user_id'], job['max_id'],
+                                              on_progress=on_progress)
+            _update(job_id, status='done' if success else 'failed', finished_at=time.time())
+        except Exception:
+            logger.exception("Delete job %s failed", job_id)
+            _update(job_id, status='failed', finished_at=time.time())
+        finally:
+            _job_queue.task_done()
@@ -1,35 +1,191 @@
 """
 Sage - Email Utilities
-Handles OTP generation and email sending
+Handles OTP generation and email sending.
+Mail is queued and delivered by background workers that each keep a
+long-lived authenticated SMTP connection, so routes never wait on SMTP.
 """
 
 import smtplib
-import random
+import secrets
 import string
+import queue
+import threading
+import time
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import os
 
+import otp_store
+from metrics import SMTP_SEND_SECONDS
+from logs import get_logger
+
+logger = get_logger(__name__)
+
 # Email configuration from environment
 SMTP_EMAIL = os.environ.get('SMTP_EMAIL', '')
 SMTP_PASSWORD = os.environ.get('SMTP_PASSWORD', '')  # App password for Gmail
 SMTP_HOST = os.environ.get('SMTP_HOST', 'smtp.gmail.com')
 SMTP_PORT = int(os.environ.get('SMTP_PORT', 587))
+SMTP_STARTTLS = os.environ.get('SMTP_STARTTLS', 'true').lower() == 'true'  # false for a local SMTP stand-in
+
+# Outbound mail queue
+SMTP_POOL_SIZE = int(os.environ.get('SMTP_POOL_SIZE', 2))
+MAIL_QUEUE_SIZE = int(os.environ.get('MAIL_QUEUE_SIZE', 1000))
+SMTP_IDLE_CHECK_SECONDS = 60   # NOOP before reusing a connection idle longer than this
+MAIL_SEND_ATTEMPTS = 3
 
-# Store OTPs temporarily (in production, use Redis or database)
-otp_store = {}
+OTP_MESSAGES = {
+    otp_store.OK: "OTP verified successfully.",
+    otp_store.MISSING: "OTP not found. Please request a new one.",
+    otp_store.EXPIRED: "OTP has expired. Please request a new one.",
+    otp_store.INVALID: "Invalid OTP. Please try again.",
+    otp_store.LOCKED: "Too many incorrect attempts. Please request a new OTP.",
+}
 
 
 def generate_otp(length=6):
     """Generate a random numeric OTP."""
-    return ''.join(random.choices(string.digits, k=length))
+    return ''.join(secrets.choice(string.digits) for _ in range(length))
+
+
+# ============== MAIL QUEUE ==============
+
+class SMTPWorker(threading.Thread):
+    """Delivers queued messages over one persistent SMTP connection."""
+
+    def __init__(self, mail_queue, name):
+        super().__init__(name=name, daemon=True)
+        self.mail_queue = mail_queue
+        self.server = None
+        self.last_used = 0
+
+    def _connect(self):
+        server = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=30)
+        if SMTP_STARTTLS:
+            server.starttls()
+        server.login(SMTP_EMAIL, SMTP_PASSWORD)
+        self.server = server
+
+    def _disconnect(self):
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except Exception:
+                pass
+        self.server = None
+
+    def _ensure_connection(self):
+        if self.server is not None and time.monotonic() - self.last_used > SMTP_IDLE_CHECK_SECONDS:
+            try:
+                if self.server.noop()[0] != 250:
+                    self._disconnect()
+            except smtplib.SMTPException:
+                self._disconnect()
+        if self.server is None:
+            self._connect()
+
+    def deliver(self, to_email, msg):
+        """
+        Send one message, reconnecting and retrying on connection failures.
+        A permanent (5xx) rejection of the recipient or message is not
+        retried and leaves the connection open for the next message.
+        """
+        for attempt in range(1, MAIL_SEND_ATTEMPTS + 1):
+            try:
+                self._ensure_connection()
+                self.server.sendmail(SMTP_EMAIL, to_email, msg.as_string())
+                self.last_used = time.monotonic()
+                return True
+            except smtplib.SMTPRecipientsRefused as e:
+                logger.error("SMTP server refused recipient %s: %s", to_email, e.recipients)
+                self.last_used = time.monotonic()
+                return False
+            except smtplib.SMTPResponseException as e:
+                if e.smtp_code < 500:
+                    logger.warning("SMTP send attempt %s to %s failed: %s", attempt, to_email, e)
+                    self._disconnect()
+                    time.sleep(min(2 ** attempt, 10))
+                    continue
+                logger.error("SMTP server rejected email to %s: %s %s", to_email, e.smtp_code, e.smtp_error)
+                if self.server is not None:
+                    try:
+                        self.server.rset()
+                        self.last_used = time.monotonic()
+                    except smtplib.SMTPException:
+                        self._disconnect()
+                return False
+            except (smtplib.SMTPException, OSError) as e:
+                logger.warning("SMTP send attempt %s to %s failed: %s", attempt, to_email, e)
+                self._disconnect()
+                time.sleep(min(2 ** attempt, 10))
+        return False
+
+    def run(self):
+        while True:
+            to_email, msg = self.mail_queue.get()
+            started = time.perf_counter()
+            try:
+                sent = self.deliver(to_email, msg)
+                SMTP_SEND_SECONDS.observe(time.perf_counter() - started, result='sent' if sent else 'failed')
+                if sent:
+                    logger.info("Email sent to %s", to_email, extra={'event': 'email_sent'})
+                else:
+                    logger.error("Giving up on email to %s", to_email)
+            except Exception:
+                # Keep the worker alive; a bad message must not stall the queue
+                logger.exception("Unexpected error sending email to %s", to_email)
+                self._disconnect()
+            finally:
+                self.mail_queue.task_done()
+
+
+_mail_queue = queue.Queue(maxsize=MAIL_QUEUE_SIZE)
+_workers = []
+_workers_lock = threading.Lock()
+
+
+def _ensure_workers():
+    with _workers_lock:
+        # Replace workers that died (or didn't survive a fork)
+        _workers[:] = [w for w in _workers if w.is_alive()]
+        names = {w.name for w in _workers}
+        index = 0
+        while len(_workers) < SMTP_POOL_SIZE:
+            name = f"smtp-worker-{index}"
+            index += 1
+            if name in names:
+                continue
+            worker = SMTPWorker(_mail_queue, name)
+            worker.start()
+            _workers.append(worker)
+
+
+def enqueue_email(to_email, msg):
+    """Queue a message for background delivery. Returns False if the queue is full."""
+    _ensure_workers()
+    try:
+        _mail_queue.put_nowait((to_email, msg))
+        return True
+    except queue.Full:
+        logger.error("Mail queue full, dropping email to %s", to_email)
+        return False
+
+
+def wait_for_mail_queue():
+    """Block until every queued message has been handled (used by tests/scripts)."""
+    _mail_queue.join()
+
+
+def get_mail_queue_stats():
+    """SMTP worker pool size and messages waiting to be sent."""
+    return {'workers': sum(1 for w in _workers if w.is_alive()), 'queued': _mail_queue.qsize(), 'max_queued': MAIL_QUEUE_SIZE}
 
 
 def send_otp_email(to_email, otp, purpose="verification"):
-    """Send OTP email for verification or password reset."""
+    """Queue an OTP email for verification or password reset."""
     
     if not SMTP_EMAIL or not SMTP_PASSWORD:
-        print("SMTP credentials not configured")
+        logger.error("SMTP credentials not configured")
         return False
     
     subject = "Sage - Email Verification OTP" if purpose == "verification" else "Sage - Password Reset OTP"
@@ -77,68 +233,38 @@ def send_otp_email(to_email, otp, purpose="verification"):
     </html>
     """
     
-    try:
-        msg = MIMEMultipart('alternative')
-        msg['Subject'] = subject
-        msg['From'] = f"Sage Healthcare <{SMTP_EMAIL}>"
-        msg['To'] = to_email
-        
-        msg.attach(MIMEText(html_content, 'html'))
-        
-        with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as server:
-            server.starttls()
-            server.login(SMTP_EMAIL, SMTP_PASSWORD)
-            server.sendmail(SMTP_EMAIL, to_email, msg.as_string())
-        
-        print(f"OTP email sent to {to_email}")
-        return True
-        
-    except Exception as e:
-        print(f"Failed to send email: {e}")
-        return False
+    msg = MIMEMultipart('alternative')
+    msg['Subject'] = subject
+    msg['From'] = f"Sage Healthcare <{SMTP_EMAIL}>"
+    msg['To'] = to_email
+    
+    msg.attach(MIMEText(html_content, 'html'))
+    
+    return enqueue_email(to_email, msg)
 
 
 def store_otp(email, otp, purpose="verification"):
     """Store OTP for verification."""
-    import time
-    otp_store[f"{purpose}:{email}"] = {
-        'otp': otp,
-        'created_at': time.time(),
-        'expires_at': time.time() + 600  # 10 minutes
-    }
+    return otp_store.get_otp_store().put(f"{purpose}:{email}", otp)
 
 
 def verify_otp(email, otp, purpose="verification"):
     """Verify the OTP."""
-    import time
-    key = f"{purpose}:{email}"
-    
-    if key not in otp_store:
-        return False, "OTP not found. Please request a new one."
-    
-    stored = otp_store[key]
-    
-    if time.time() > stored['expires_at']:
-        del otp_store[key]
-        return False, "OTP has expired. Please request a new one."
-    
-    if stored['otp'] != otp:
-        return False, "Invalid OTP. Please try again."
-    
-    # OTP is valid, remove it
-    del otp_store[key]
-    return True, "OTP verified successfully."
+    result = otp_store.get_otp_store().check(f"{purpose}:{email}", str(otp or ''))
+    return result == otp_store.OK, OTP_MESSAGES[result]
 
 
 def send_verification_otp(email):
     """Generate and send verification OTP."""
     otp = generate_otp()
-    store_otp(email, otp, "verification")
+    if not store_otp(email, otp, "verification"):
+        return False, otp
     return send_otp_email(email, otp, "verification"), otp
 
 
 def send_password_reset_otp(email):
     """Generate and send password reset OTP."""
     otp = generate_otp()
-    store_otp(email, otp, "reset")
-    return send_otp_email(email, otp, "reset"), otp
\ No newline at end of file
+    if not store_otp(email, otp, "reset"):
+        return False, otp
+    return send_otp_email(email, otp, "reset"), otp
@@ -0,0 +1,151 @@
+"""
+Sage - Idempotency Keys
+Clients may send an Idempotency-Key header with /api/chat and /api/upload.
+The first request with a key runs normally; a concurrent duplicate waits
+for that execution and gets its result, and later duplicates within
+IDEMPOTENCY_TTL_SECONDS replay the cached result. Either way the message
+is saved and sent to Claude only once. Only 2xx results are cached, so a
+failed attempt can be retried with the same key.
+
+A key is bound to a fingerprint of the request it first arrived with;
+reusing it for a different message or file raises IdempotencyKeyReused
+(422) instead of replaying the other request's reply.
+"""
+
+import asyncio
+import hashlib
+import os
+import threading
+
+from cache import get_cache, SingleFlight
+
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', 600))
+MAX_KEY_LENGTH = 255
+INTERRUPTED_RETRY_AFTER = 1  # seconds suggested to duplicates of a cancelled request
+
+
+class IdempotencyKeyReused(Exception):
+    """Raised when a key arrives again with a different request body."""
+
+
+class IdempotentRequestInterrupted(Exception):
+    """Raised to duplicates whose original request was cancelled; retrying is safe."""
+
+    def __init__(self):
+        super().__init__("Original request was cancelled")
+        self.retry_after = INTERRUPTED_RETRY_AFTER
+
+
+_flight = SingleFlight()
+_in_flight = {}     # key -> [fingerprint, callers] for run_once
+_in_flight_lock = threading.Lock()
+_async_calls = {}   # key -> (asyncio.Future of the in-flight execution, fingerprint)
+
+
+def _results():
+    return get_cache('idempotency', ttl=IDEMPOTENCY_TTL_SECONDS)
+
+
+def idempotency_key(user_id, scope, header_value):
+    """Cache key for a request's Idempotency-Key header, or None if it has none."""
+    header_value = (header_value or '').strip()
+    if not header_value or len(header_value) > MAX_KEY_LENGTH:
+        return None
+    digest = hashlib.sha1(header_value.encode('utf-8')).hexdigest()
+    return f"{user_id}:{scope}:{digest}"
+
+
+def request_fingerprint(*parts):
+    """Digest of the request inputs (str or bytes) a key is bound to."""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        digest.update(hashlib.sha256(part).digest())
+    return digest.hexdigest()
+
+
+def _replay(cached, fingerprint):
+    payload, status, stored = cached
+    if stored != fingerprint:
+        raise IdempotencyKeyReused("Idempotency-Key was already used for a different request")
+    return payload, status, True
+
+
+def run_once(key, fn, fingerprint=None):
+    """
+    Run fn() -> (payload, status) at most once per key.
+    Returns (payload, status, replayed).
+    """
+    if key is None:
+        return fn() + (False,)
+    
+    results = _results()
+    cached = results.get(key)
+    if cached is not None:
+        return _replay(cached, fingerprint)
+    
+    with _in_flight_lock:
+        holder = _in_flight.get(key)
+        if holder is None:
+            _in_flight[key] = [fingerprint, 1]
+        elif holder[0] != fingerprint:
+            raise IdempotencyKeyReused("Idempotency-Key is in use by a different request")
+        else:
+            holder[1] += 1
+    
+    ran = []
+    
+    def execute():
+        ran.append(True)
+        result = fn()
+        if 200 <= result[1] < 300:
+            results.set(key, result + (fingerprint,))
+        return result
+    
+    try:
+        return _flight.do(key, execute) + (not ran,)
+    finally:
+        with _in_flight_lock:
+            holder = _in_flight[key]
+            holder[1] -= 1
+            if not holder[1]:
+                del _in_flight[key]
+
+
+async def run_once_async(key, fn, fingerprint=None):
+    """run_once for the ASGI routes; fn is a coroutine function."""
+    if key is None:
+        return (await fn()) + (False,)
+    
+    results = _results()
+    cached = results.get(key)
+    if cached is not None:
+        return _replay(cached, fingerprint)
+    
+    in_flight = _async_calls.get(key)
+    if in_flight is not None:
+        call, stored = in_flight
+        if stored != fingerprint:
+            raise IdempotencyKeyReused("Idempotency-Key is in use by a different request")
+        return (await asyncio.shield(call)) + (True,)
+    
+    call = asyncio.get_running_loop().create_future()
+    _async_calls[key] = (call, fingerprint)
+    try:
+        result = await fn()
+        if 200 <= result[1] < 300:
+            results.set(key, result + (fingerprint,))
+        call.set_result(result)
+        return result + (False,)
+    except asyncio.CancelledError:
+        # The client went away; waiting duplicates get a retryable error, not a cancellation
+        call.set_exception(IdempotentRequestInterrupted())
+        call.exception()
+        raise
+    except Exception as e:
+        call.set_exception(e)
+        call.exception()  # followers re-raise it; don't warn if there are none
+        raise
+    finally:
+        del _async_calls[key]
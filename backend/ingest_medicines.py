@@ -0,0 +1,253 @@
+"""
+Sage - Medicine Catalogue Ingestion
+Streams a CSV catalogue into medicines_master in fixed-size chunks:
+rows are staged with executemany, upserted by natural key
+(name, manufacturer, pack_size), and products missing from the file
+are marked is_discontinued. Memory use does not grow with file size.
+
+Every phase runs in primary-key batches that commit on their own, so
+no statement holds row locks across the whole table. The import is not
+one transaction: each phase is idempotent, and a run that fails part
+way is completed by running the same file again.
+Each import bumps the catalogue version, which tells running servers to
+rebuild their search index on their next check.
+
+The discontinue step is skipped when the file has fewer rows than
+MIN_FILE_FRACTION of the currently active catalogue (an empty, truncated
+or wrongly delimited file would otherwise discontinue everything);
+--force overrides the check.
+
+Usage:
+    python backend/ingest_medicines.py catalogue.csv [--chunk-size 5000]
+        [--keep-missing] [--force] [--app-url http://localhost:5000]
+"""
+
+import argparse
+import csv
+import hashlib
+import os
+import sys
+import time
+
+import requests
+
+from database import get_connection, ensure_schema
+
+# Accepted header spellings for each column (first match wins)
+COLUMN_ALIASES = {
+    'name': ('name',),
+    'manufacturer': ('manufacturer', 'manufacturer_name'),
+    'pack_size': ('pack_size', 'pack_size_label'),
+    'composition1': ('composition1', 'short_composition1'),
+    'price': ('price', 'price(₹)', 'price(rs)'),
+    'is_discontinued': ('is_discontinued',),
+}
+
+# Smallest file, relative to the active catalogue, trusted to mark products discontinued
+MIN_FILE_FRACTION = float(os.environ.get('INGEST_MIN_FILE_FRACTION', 0.5))
+
+NATURAL_KEY_JOIN = """
+    m.name = s.name AND m.manufacturer <=> s.manufacturer AND m.pack_size <=> s.pack_size
+"""
+
+
+def resolve_columns(header):
+    """Map our column names to the CSV's header names."""
+    lowered = {h.strip().lower(): h for h in header}
+    columns = {}
+    for column, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias in lowered:
+                columns[column] = lowered[alias]
+                break
+    if 'name' not in columns:
+        raise ValueError("CSV must have a 'name' column")
+    return columns
+
+
+def parse_row(row, columns):
+    """Convert one CSV row into a staging tuple, or None if it has no name."""
+    def value(column):
+        raw = row.get(columns.get(column, ''), '')
+        raw = raw.strip() if raw else ''
+        return raw or None
+
+    name = value('name')
+    if not name:
+        return None
+    manufacturer = value('manufacturer')
+    pack_size = value('pack_size')
+
+    price = value('price')
+    try:
+        price = float(price.replace(',', '')) if price else None
+    except ValueError:
+        price = None
+
+    discontinued = (value('is_discontinued') or '').lower() in ('true', '1', 'yes', 'y')
+    # The JOIN compares under a case-insensitive collation, so the key must too
+    normalised = '|'.join((field or '').casefold() for field in (name, manufacturer, pack_size))
+    key = hashlib.sha1(normalised.encode('utf-8')).hexdigest()
+    return (key, name, manufacturer, pack_size, value('composition1'), price, discontinued)
+
+
+def stream_chunks(path, chunk_size):
+    """Yield lists of parsed rows, chunk_size at a time."""
+    with open(path, newline='', encoding='utf-8-sig') as file:
+        reader = csv.DictReader(file)
+        columns = resolve_columns(reader.fieldnames or [])
+        chunk = []
+        for row in reader:
+            parsed = parse_row(row, columns)
+            if parsed:
+                chunk.append(parsed)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def id_ranges(cursor, bounds_query, size):
+    """Yield inclusive (low, high) id ranges of `size` covering bounds_query's MIN/MAX."""
+    cursor.execute(bounds_query)
+    low, high = cursor.fetchone()
+    if low is None:
+        return
+    for start in range(low, high + 1, size):
+        yield start, min(start + size - 1, high)
+
+
+def ingest(path, chunk_size=5000, mark_missing=True, force=False):
+    """Load the CSV at path into medicines_master. Returns a stats dict."""
+    if not ensure_schema():
+        raise RuntimeError("Could not prepare the database schema")
+    connection = get_connection()
+    if not connection:
+        raise RuntimeError("Could not connect to the database")
+
+    started = time.perf_counter()
+    stats = {'rows_read': 0, 'updated': 0, 'inserted': 0, 'discontinued': 0, 'discontinue_skipped': False}
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT COUNT(*) FROM medicines_master WHERE is_discontinued = FALSE")
+        active_before = cursor.fetchone()[0]
+        
+        cursor.execute("""
+            CREATE TEMPORARY TABLE medicines_staging (
+                id INT AUTO_INCREMENT PRIMARY KEY,
+                natural_key CHAR(40) NOT NULL UNIQUE,
+                name VARCHAR(255) NOT NULL,
+                manufacturer VARCHAR(255),
+                pack_size VARCHAR(255),
+                composition1 TEXT,
+                price DECIMAL(10, 2),
+                is_discontinued BOOLEAN NOT NULL DEFAULT FALSE,
+                INDEX idx_staging_name (name)
+            )
+        """)
+
+        # Stage the file chunk by chunk; later rows for the same key win
+        insert = """
+            INSERT INTO medicines_staging
+                (natural_key, name, manufacturer, pack_size, composition1, price, is_discontinued)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                composition1 = VALUES(composition1), price = VALUES(price),
+                is_discontinued = VALUES(is_discontinued)
+        """
+        for chunk in stream_chunks(path, chunk_size):
+            cursor.executemany(insert, chunk)
+            stats['rows_read'] += len(chunk)
+            elapsed = time.perf_counter() - started
+            print(f"  staged {stats['rows_read']} rows ({stats['rows_read'] / elapsed:,.0f} rows/s)")
+
+        update = f"""
+            UPDATE medicines_master m JOIN medicines_staging s ON {NATURAL_KEY_JOIN}
+            SET m.composition1 = s.composition1, m.price = s.price,
+                m.is_discontinued = s.is_discontinued
+            WHERE s.id BETWEEN %s AND %s
+        """
+        insert_new = f"""
+            INSERT INTO medicines_master (name, manufacturer, pack_size, composition1, price, is_discontinued)
+            SELECT s.name, s.manufacturer, s.pack_size, s.composition1, s.price, s.is_discontinued
+            FROM medicines_staging s
+            LEFT JOIN medicines_master m ON {NATURAL_KEY_JOIN}
+            WHERE m.name IS NULL AND s.id BETWEEN %s AND %s
+        """
+        for low, high in id_ranges(cursor, "SELECT MIN(id), MAX(id) FROM medicines_staging", chunk_size):
+            cursor.execute(update, (low, high))
+            stats['updated'] += cursor.rowcount
+            cursor.execute(insert_new, (low, high))
+            stats['inserted'] += cursor.rowcount
+
+        if mark_missing and not force and (
+                stats['rows_read'] == 0 or stats['rows_read'] < active_before * MIN_FILE_FRACTION):
+            print(f"Not marking missing products discontinued: file has {stats['rows_read']} rows but "
+                  f"{active_before} are active (minimum {MIN_FILE_FRACTION:.0%}); use --force to override")
+            stats['discontinue_skipped'] = True
+        elif mark_missing:
+            discontinue = f"""
+                UPDATE medicines_master m LEFT JOIN medicines_staging s ON {NATURAL_KEY_JOIN}
+                SET m.is_discontinued = TRUE
+                WHERE s.name IS NULL AND m.is_discontinued = FALSE AND m.id BETWEEN %s AND %s
+            """
+            bounds = "SELECT MIN(id), MAX(id) FROM medicines_master WHERE is_discontinued = FALSE"
+            for low, high in id_ranges(cursor, bounds, chunk_size):
+                cursor.execute(discontinue, (low, high))
+                stats['discontinued'] += cursor.rowcount
+
+        # Last, so servers only rebuild their index from a finished import
+        cursor.execute("""
+            INSERT INTO catalogue_state (name, version) VALUES ('medicines', 1)
+            ON DUPLICATE KEY UPDATE version = version + 1
+        """)
+    finally:
+        cursor.close()
+        connection.close()
+
+    stats['seconds'] = round(time.perf_counter() - started, 2)
+    stats['rows_per_second'] = round(stats['rows_read'] / stats['seconds']) if stats['seconds'] else 0
+    return stats
+
+
+def request_reindex(app_url):
+    """Ask a running server to rebuild its in-memory search index."""
+    token = os.environ.get('ADMIN_TOKEN', '')
+    if not token:
+        print("ADMIN_TOKEN not set; running servers will pick up changes on their next scheduled refresh")
+        return False
+    try:
+        response = requests.post(f"{app_url.rstrip('/')}/admin/medicines/reindex",
+                                 headers={'X-Admin-Token': token}, timeout=120)
+        print(f"Reindex: {response.status_code} {response.text.strip()}")
+        return response.ok
+    except requests.RequestException as e:
+        print(f"Reindex request failed: {e}")
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load a medicine catalogue CSV into medicines_master")
+    parser.add_argument('csv_path')
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    parser.add_argument('--keep-missing', action='store_true',
+                        help="don't mark products absent from the file as discontinued")
+    parser.add_argument('--force', action='store_true',
+                        help="mark missing products discontinued even if the file looks truncated")
+    parser.add_argument('--app-url', default=os.environ.get('SAGE_APP_URL', ''),
+                        help="running server whose search index should be rebuilt afterwards")
+    args = parser.parse_args()
+
+    print(f"Ingesting {args.csv_path}...")
+    stats = ingest(args.csv_path, args.chunk_size, mark_missing=not args.keep_missing, force=args.force)
+    print(f"Done: {stats['rows_read']} rows in {stats['seconds']}s ({stats['rows_per_second']:,} rows/s), "
+          f"{stats['updated']} updated, {stats['inserted']} inserted, {stats['discontinued']} discontinued")
+
+    if args.app_url:
+        request_reindex(args.app_url)
+    return 1 if stats['discontinue_skipped'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,217 @@
+"""
+Sage - LLM Admission Control
+Every Claude call from /api/chat and /api/upload first takes a slot here.
+At most LLM_MAX_CONCURRENT calls run at once; the rest wait in a weighted
+fair queue (start-time fair queuing keyed by user_id), so a user who
+sends many messages only delays their own later requests. A request
+that would wait longer than LLM_MAX_QUEUE_WAIT seconds, or arrives when
+LLM_MAX_QUEUE requests are already waiting, is rejected with
+LLMOverloaded, which routes turn into 503 + Retry-After.
+Works for both Flask request threads and ASGI coroutines.
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from tracing import span
+
+LLM_MAX_CONCURRENT = int(os.environ.get('LLM_MAX_CONCURRENT', 8))
+LLM_MAX_QUEUE = int(os.environ.get('LLM_MAX_QUEUE', 100))
+LLM_MAX_QUEUE_WAIT = float(os.environ.get('LLM_MAX_QUEUE_WAIT', 20))
+
+# Upper bounds (seconds) of the queue wait histogram
+WAIT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20)
+
+# Relative cost of a request; image analysis is a larger, slower call
+CHAT_COST = 1
+IMAGE_COST = 2
+
+
+class LLMOverloaded(Exception):
+    """Raised when a request can't be admitted in time."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"LLM capacity exhausted, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ('user_id', 'notify', 'enqueued_at', 'granted', 'cancelled')
+
+    def __init__(self, user_id, notify):
+        self.user_id = user_id
+        self.notify = notify
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+        self.cancelled = False
+
+
+class FairScheduler:
+    """Concurrency-capped, per-user weighted fair queue."""
+
+    def __init__(self, max_concurrent=LLM_MAX_CONCURRENT, max_queue=LLM_MAX_QUEUE, max_wait=LLM_MAX_QUEUE_WAIT):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._heap = []               # (virtual start tag, seq, waiter)
+        self._seq = itertools.count()
+        self._virtual_time = 0.0
+        self._last_finish = {}        # user_id -> virtual finish tag of their latest request
+        self._in_flight = 0
+        self._waiting = 0
+        self._service_time = 5.0      # EWMA of slot hold time, for Retry-After
+        self._stats = {'admitted': 0, 'rejected_queue_full': 0, 'rejected_timeout': 0,
+                       'wait_count': 0, 'wait_sum': 0.0}
+        self._wait_buckets = [0] * (len(WAIT_BUCKETS) + 1)
+
+    # ---- queueing ----
+
+    def _retry_after_locked(self):
+        backlog = (self._waiting + 1) / max(1, self.max_concurrent)
+        return max(1, min(60, math.ceil(backlog * self._service_time)))
+
+    def _enqueue(self, user_id, cost, weight, notify):
+        """Grant a slot now or queue the request. Raises LLMOverloaded if the queue is full."""
+        waiter = _Waiter(user_id, notify)
+        with self._lock:
+            start = max(self._virtual_time, self._last_finish.get(user_id, 0.0))
+            self._last_finish[user_id] = start + cost / weight
+            if len(self._last_finish) > 10000:
+                self._last_finish = {u: f for u, f in self._last_finish.items() if f > self._virtual_time}
+
+            if self._in_flight < self.max_concurrent and not self._waiting:
+                self._grant_locked(waiter, start)
+            elif self._waiting >= self.max_queue:
+                self._stats['rejected_queue_full'] += 1
+                raise LLMOverloaded(self._retry_after_locked())
+            else:
+                heapq.heappush(self._heap, (start, next(self._seq), waiter))
+                self._waiting += 1
+        return waiter
+
+    def _grant_locked(self, waiter, start):
+        waiter.granted = True
+        self._in_flight += 1
+        self._virtual_time = max(self._virtual_time, start)
+        self._stats['admitted'] += 1
+        self._record_wait_locked(time.monotonic() - waiter.enqueued_at)
+
+    def _dispatch_locked(self):
+        while self._heap and self._in_flight < self.max_concurrent:
+            start, _, waiter = heapq.heappop(self._heap)
+            if waiter.cancelled:
+                continue
+            self._waiting -= 1
+            self._grant_locked(waiter, start)
+            waiter.notify()
+
+    def _give_up(self, waiter):
+        """A waiter timed out or was cancelled. Returns True if it was granted meanwhile."""
+        with self._lock:
+            if waiter.granted:
+                return True
+            waiter.cancelled = True
+            self._waiting -= 1
+            return False
+
+    def _record_wait_locked(self, seconds):
+        self._stats['wait_count'] += 1
+        self._stats['wait_sum'] += seconds
+        for i, bound in enumerate(WAIT_BUCKETS):
+            if seconds <= bound:
+                self._wait_buckets[i] += 1
+                return
+        self._wait_buckets[-1] += 1
+
+    def _timed_out(self):
+        with self._lock:
+            self._stats['rejected_timeout'] += 1
+            return LLMOverloaded(self._retry_after_locked())
+
+    # ---- public API ----
+
+    def acquire(self, user_id, cost=CHAT_COST, weight=1.0):
+        """Block the calling thread until a slot is granted."""
+        event = threading.Event()
+        waiter = self._enqueue(user_id, cost, weight, event.set)
+        if not waiter.granted and not event.wait(self.max_wait):
+            if not self._give_up(waiter):
+                raise self._timed_out()
+
+    async def acquire_async(self, user_id, cost=CHAT_COST, weight=1.0):
+        """Await a slot without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def notify():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(True))
+
+        waiter = self._enqueue(user_id, cost, weight, notify)
+        if waiter.granted:
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.max_wait)
+        except asyncio.TimeoutError:
+            if not self._give_up(waiter):
+                raise self._timed_out()
+        except asyncio.CancelledError:
+            # Client went away; hand back a slot we may have been given meanwhile
+            if self._give_up(waiter):
+                self.release(0)
+            raise
+
+    def release(self, held_seconds):
+        with self._lock:
+            self._in_flight -= 1
+            if held_seconds:
+                self._service_time = 0.9 * self._service_time + 0.1 * held_seconds
+            self._dispatch_locked()
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                self._stats,
+                in_flight=self._in_flight,
+                queue_depth=self._waiting,
+                max_concurrent=self.max_concurrent,
+                wait_buckets=list(zip(WAIT_BUCKETS + (float('inf'),), self._wait_buckets)),
+            )
+
+
+_scheduler = FairScheduler()
+
+
+@contextmanager
+def admit(user_id, cost=CHAT_COST):
+    """Hold an LLM slot for the duration of the block (request threads)."""
+    with span('llm.admission_wait', cost=cost):
+        _scheduler.acquire(user_id, cost)
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        _scheduler.release(time.monotonic() - started)
+
+
+@asynccontextmanager
+async def admit_async(user_id, cost=CHAT_COST):
+    """Hold an LLM slot for the duration of the block (ASGI routes)."""
+    with span('llm.admission_wait', cost=cost):
+        await _scheduler.acquire_async(user_id, cost)
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        _scheduler.release(time.monotonic() - started)
+
+
+def get_llm_queue_stats():
+    """In-flight calls, queue depth, rejections and the queue wait histogram."""
+    return _scheduler.stats()
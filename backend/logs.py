@@ -0,0 +1,156 @@
+"""
+Sage - Structured Logging
+Request threads only build a LogRecord and put it on a bounded queue;
+a QueueListener thread formats it (one JSON object per line, with a
+Cloud Logging compatible "severity") and writes it to stdout. When the
+queue is full records are dropped and counted instead of blocking.
+
+Configuration:
+    LOG_LEVEL=INFO                          default level for every module
+    LOG_LEVELS=database=WARNING,sage_ai=DEBUG   per-module overrides
+    LOG_SAMPLE_RATES=vector_match=0.05      keep this fraction of an event
+    LOG_FORMAT=json|text
+
+High-frequency events pass extra={'event': name}; the sampling filter
+keeps LOG_SAMPLE_RATES[name] of them and records the rate it used.
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json').lower()
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+ROOT_LOGGER = 'sage'
+
+DEFAULT_SAMPLE_RATES = {'vector_match': 0.05}
+
+# Attributes every LogRecord has; anything else came from extra= and is emitted as a field
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def _parse_pairs(value, convert):
+    """'a=1,b=2' -> {'a': convert('1'), 'b': convert('2')}, skipping malformed pairs."""
+    pairs = {}
+    for item in value.split(','):
+        key, sep, raw = item.partition('=')
+        if not sep or not key.strip():
+            continue
+        try:
+            pairs[key.strip()] = convert(raw.strip())
+        except ValueError:
+            print(f"Ignoring bad logging setting: {item}", file=sys.stderr)
+    return pairs
+
+
+LOG_LEVELS = _parse_pairs(os.environ.get('LOG_LEVELS', ''), str.upper)
+LOG_SAMPLE_RATES = dict(DEFAULT_SAMPLE_RATES, **_parse_pairs(os.environ.get('LOG_SAMPLE_RATES', ''), float))
+
+
+class SamplingFilter(logging.Filter):
+    """Keep a fraction of records tagged with a sampled `event`."""
+
+    def filter(self, record):
+        rate = LOG_SAMPLE_RATES.get(getattr(record, 'event', None))
+        if rate is None or rate >= 1:
+            return True
+        if random.random() >= rate:
+            return False
+        record.sample_rate = rate
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that never blocks the caller: a full queue drops the record."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Formatting happens on the listener thread; only resolve the message here
+        # so mutable arguments can't change before it is written
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'severity': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+_queue_handler = DroppingQueueHandler(_queue)
+_queue_handler.addFilter(SamplingFilter())
+_listener = None
+
+
+def _configure():
+    global _listener
+    output = logging.StreamHandler(sys.stdout)
+    if LOG_FORMAT == 'json':
+        output.setFormatter(JSONFormatter())
+    else:
+        output.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+
+    root = logging.getLogger(ROOT_LOGGER)
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(_queue_handler)
+    root.propagate = False
+    for name, level in LOG_LEVELS.items():
+        _logger_for(name).setLevel(level)
+
+    _listener = QueueListener(_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def _restart_listener():
+    """The listener thread does not survive fork (e.g. gunicorn --preload)."""
+    _listener._thread = None
+    _listener.start()
+
+
+def _logger_for(name):
+    if name != ROOT_LOGGER and not name.startswith(ROOT_LOGGER + '.'):
+        name = f"{ROOT_LOGGER}.{name}"
+    return logging.getLogger(name)
+
+
+def get_logger(name):
+    """Logger for a backend module, e.g. get_logger(__name__) -> 'sage.database'."""
+    return _logger_for(name.rsplit('.', 1)[-1])
+
+
+def get_logging_stats():
+    return {'queued': _queue.qsize(), 'dropped': _queue_handler.dropped}
+
+
+_configure()
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_listener)
@@ -0,0 +1,399 @@
+"""
+Sage - In-Memory Medicine Search Index
+Serves /api/medicines/search autocomplete without touching MySQL:
+a sorted name array (bisect) for prefix matches plus n-gram posting
+lists for infix matches. Rebuilt off to the side and swapped atomically.
+Fuzzy mode tolerates typos via a trigram filter over name/composition
+words followed by a bounded Damerau-Levenshtein (OSA) re-rank.
+A composition index (product <-> ingredients) powers local allergy and
+duplicate-ingredient checks for a user's medications.
+"""
+
+import hashlib
+import os
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from heapq import nlargest
+from itertools import chain
+
+from database import get_active_medicines, get_catalogue_version
+from cache import get_cache, SingleFlight
+from logs import get_logger
+
+logger = get_logger(__name__)
+
+SEARCH_LIMIT = 15
+INDEX_REFRESH_SECONDS = int(os.environ.get('MEDICINE_INDEX_REFRESH_SECONDS', 300))  # catalogue version check
+SEARCH_CACHE_TTL = int(os.environ.get('MEDICINE_SEARCH_CACHE_TTL', 600))
+
+# Column order of each stored row (matches the API response fields)
+FIELDS = ('name', 'manufacturer', 'pack_size', 'composition1', 'price')
+
+# Fuzzy search: words shorter than this aren't indexed, and at most this
+# many trigram candidates are re-ranked by edit distance
+FUZZY_MIN_QUERY = 4
+FUZZY_MAX_CANDIDATES = 150
+FUZZY_MAX_OFFSET = 16
+
+_WORD_RE = re.compile(r'[a-z]{3,}')
+
+# Most medication check lines to inject into the system prompt
+MAX_MEDICATION_CHECKS = 10
+
+
+def _grams(text, n):
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def _positional_grams(word):
+    """(trigram, offset) pairs of a word anchored at its start, up to FUZZY_MAX_OFFSET."""
+    padded = '$' + word
+    return {(padded[i:i + 3], i) for i in range(min(len(padded) - 2, FUZZY_MAX_OFFSET))}
+
+
+def parse_ingredients(composition):
+    """'Amoxycillin (500mg) + Clavulanic Acid (125mg)' -> ('amoxycillin', 'clavulanic acid')"""
+    ingredients = set()
+    for part in re.split(r'[+,;]', composition or ''):
+        part = re.sub(r'\(.*?\)', ' ', part.lower())
+        part = ' '.join(re.sub(r'[^a-z ]', ' ', part).split())
+        if len(part) >= 3:
+            ingredients.add(part)
+    return tuple(sorted(ingredients))
+
+
+def max_edits(query):
+    """Edit budget by query length: 1 typo up to 6 characters, else 2."""
+    return 1 if len(query) <= 6 else 2
+
+
+def prefix_distance(query, term, max_distance):
+    """
+    Optimal-string-alignment distance between query and the closest
+    prefix of term (so partially typed words still match).
+    Returns max_distance + 1 as soon as the bound is exceeded.
+    """
+    n = len(query)
+    term = term[:n + max_distance]
+    prev_prev = None
+    prev = list(range(n + 1))
+    best = prev[n]
+
+    for i in range(1, len(term) + 1):
+        tc = term[i - 1]
+        cur = [i] + [0] * n
+        for j in range(1, n + 1):
+            qc = query[j - 1]
+            value = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (qc != tc))
+            if i > 1 and j > 1 and tc == query[j - 2] and term[i - 2] == qc:
+                value = min(value, prev_prev[j - 2] + 1)
+            cur[j] = value
+        best = min(best, cur[n])
+        if min(cur) > max_distance:
+            break
+        prev_prev, prev = prev, cur
+
+    return min(best, max_distance + 1)
+
+
+class MedicineIndex:
+    """Immutable prefix + infix index over medicine names."""
+
+    def __init__(self, rows):
+        # Sort like ORDER BY name under a case-insensitive collation
+        rows = sorted(rows, key=lambda r: ((r[0] or '').lower(), r[0] or ''))
+        self.rows = rows
+        # Content hash of the catalogue; part of search cache keys and ETags,
+        # and the same in every worker that loaded the same rows
+        self.version = hashlib.sha1(repr(rows).encode('utf-8')).hexdigest()[:12]
+        self.keys = [(r[0] or '').lower() for r in rows]
+
+        # Posting lists hold row positions, so they are already in name order
+        postings = {}
+        for pos, key in enumerate(self.keys):
+            for n in (2, 3):
+                for gram in _grams(key, n):
+                    postings.setdefault(gram, []).append(pos)
+        self.postings = {gram: array('I', positions) for gram, positions in postings.items()}
+        self._build_fuzzy_index()
+        self._build_composition_index()
+
+    def _build_composition_index(self):
+        """Product name -> ingredients and ingredient -> product positions."""
+        self.product_ingredients = {}
+        ingredient_products = {}
+        for pos, row in enumerate(self.rows):
+            ingredients = parse_ingredients(row[3])
+            self.product_ingredients.setdefault(self.keys[pos], ingredients)
+            for ingredient in ingredients:
+                ingredient_products.setdefault(ingredient, []).append(pos)
+        self.ingredient_products = {i: array('I', p) for i, p in ingredient_products.items()}
+
+    def resolve_ingredients(self, medicine_name):
+        """
+        Ingredients of a medicine as a user named it: an exact product name,
+        a prefix of exactly one product name, or an ingredient itself.
+        Anything ambiguous resolves to nothing rather than a guess, since
+        the result feeds allergy and duplicate warnings.
+        """
+        key = ' '.join((medicine_name or '').lower().split())
+        if not key:
+            return ()
+        if key in self.product_ingredients:
+            return self.product_ingredients[key]
+        start = bisect_left(self.keys, key)
+        end = bisect_left(self.keys, key + '\uffff', start)
+        # keys are sorted, so the range holds one distinct name iff its ends match
+        if start < end and self.keys[start] == self.keys[end - 1]:
+            return self.product_ingredients[self.keys[start]]
+        ingredient = parse_ingredients(key)
+        if ingredient and ingredient[0] in self.ingredient_products:
+            return ingredient
+        return ()
+
+    def _build_fuzzy_index(self):
+        """Distinct words of name/composition1 -> rows, plus trigram -> words."""
+        word_rows = {}   # word -> ([row positions via name], [via composition])
+        for pos, row in enumerate(self.rows):
+            for source, text in ((0, row[0]), (1, row[3])):
+                for word in set(_WORD_RE.findall((text or '').lower())):
+                    entry = word_rows.setdefault(word, ([], []))
+                    if not entry[source] or entry[source][-1] != pos:
+                        entry[source].append(pos)
+
+        self.words = list(word_rows)
+        self.word_rows = [(array('I', w[0]), array('I', w[1])) for w in word_rows.values()]
+
+        # Positional trigrams: an edit only shifts later grams by a few places,
+        # so a query gram at offset i need only be looked up at i-k..i+k
+        gram_words = {}
+        for word_id, word in enumerate(self.words):
+            for key in _positional_grams(word):
+                gram_words.setdefault(key, []).append(word_id)
+        self.gram_words = {key: array('I', ids) for key, ids in gram_words.items()}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        """Prefix matches first, then other substring matches, each by name."""
+        q = query.lower()
+        results = []
+
+        start = bisect_left(self.keys, q)
+        pos = start
+        while pos < len(self.keys) and len(results) < limit and self.keys[pos].startswith(q):
+            results.append(pos)
+            pos += 1
+
+        if len(results) < limit:
+            for pos in self._infix_candidates(q):
+                key = self.keys[pos]
+                if q in key and not key.startswith(q):
+                    results.append(pos)
+                    if len(results) >= limit:
+                        break
+
+        return [dict(zip(FIELDS, self.rows[pos])) for pos in results]
+
+    def fuzzy_search(self, query, limit=SEARCH_LIMIT):
+        """
+        Typo-tolerant search over name and composition1 words.
+        Ranked by edit distance, then name matches before composition
+        matches, then name.
+        """
+        q = query.lower().strip()
+        words = _WORD_RE.findall(q)
+        if not words:
+            return []
+        q = max(words, key=len)  # the longest word carries the most signal
+        if len(q) < FUZZY_MIN_QUERY:
+            return []
+        k = max_edits(q)
+
+        # Candidate filter: each edit can destroy at most 3 trigrams
+        q_grams = _positional_grams(q)
+        overlap = Counter(chain.from_iterable(
+            self.gram_words.get((gram, offset), ())
+            for gram, i in q_grams
+            for offset in range(max(0, i - k), i + k + 1)
+        ))
+        threshold = max(1, len(q_grams) - 3 * k)
+        candidates = [w for w, count in nlargest(FUZZY_MAX_CANDIDATES, overlap.items(), key=lambda item: item[1])
+                      if count >= threshold]
+
+        # Re-rank by bounded Damerau-Levenshtein distance
+        ranked = []
+        for word_id in candidates:
+            distance = prefix_distance(q, self.words[word_id], k)
+            if distance <= k:
+                ranked.append((distance, word_id))
+        ranked.sort()
+
+        results = []
+        seen = set()
+        for distance in range(k + 1):
+            matched = [w for d, w in ranked if d == distance]
+            for source in (0, 1):
+                positions = sorted({p for w in matched for p in self.word_rows[w][source]})
+                for pos in positions:
+                    if pos not in seen:
+                        seen.add(pos)
+                        results.append(pos)
+                        if len(results) >= limit:
+                            return [dict(zip(FIELDS, self.rows[p])) for p in results]
+        return [dict(zip(FIELDS, self.rows[p])) for p in results]
+
+    def _infix_candidates(self, q):
+        """Row positions (ascending) containing every n-gram of q, lazily."""
+        n = 3 if len(q) >= 3 else 2
+        lists = []
+        for gram in _grams(q, n):
+            posting = self.postings.get(gram)
+            if posting is None:
+                return
+            lists.append(posting)
+        if not lists:
+            return
+
+        # Walk the rarest list, probing the others by binary search
+        lists.sort(key=len)
+        rarest, others = lists[0], lists[1:]
+        for pos in rarest:
+            if all(_contains(other, pos) for other in others):
+                yield pos
+
+
+def _contains(sorted_array, value):
+    i = bisect_left(sorted_array, value)
+    return i < len(sorted_array) and sorted_array[i] == value
+
+
+_index = None
+_index_source = None   # get_catalogue_version() the current index was built from
+_index_lock = threading.Lock()
+_search_flight = SingleFlight()
+
+
+def refresh_medicine_index(force=True):
+    """
+    Rebuild the index from medicines_master and swap it in. With
+    force=False the (CPU-heavy) rebuild is skipped while the catalogue
+    version and active row count are unchanged.
+    Returns the row count, or None if the catalogue couldn't be read
+    (the previous index stays in place).
+    """
+    global _index, _index_source
+    with _index_lock:
+        source = get_catalogue_version()
+        if not force and _index is not None and source is not None and source == _index_source:
+            return len(_index)
+        started = time.perf_counter()
+        rows = get_active_medicines()
+        if rows is None:
+            return None
+        index = MedicineIndex(rows)
+        _index = index
+        _index_source = source
+        # Findings computed against the previous catalogue may be stale
+        get_cache('medication_checks').clear()
+        logger.info("Medicine index built: %s rows in %.2fs", len(index), time.perf_counter() - started)
+        return len(index)
+
+
+def search_medicines(query, limit=SEARCH_LIMIT, mode='auto', index=None):
+    """
+    Search the in-memory index (or the given snapshot of it). Returns None
+    when the index isn't ready.
+    mode: 'exact' (prefix/substring), 'fuzzy' (typo-tolerant), or 'auto'
+    (exact, falling back to fuzzy when nothing matches).
+    Returns (medicines, used_fuzzy).
+    """
+    if index is None:
+        index = _index
+    if index is None:
+        return None
+    if mode == 'fuzzy':
+        return index.fuzzy_search(query, limit), True
+    medicines = index.search(query, limit)
+    if medicines or mode == 'exact':
+        return medicines, False
+    return index.fuzzy_search(query, limit), True
+
+
+def cached_search_medicines(query, mode='auto'):
+    """
+    search_medicines() behind a result cache with single-flight, so identical
+    in-flight queries run once. Returns (medicines, used_fuzzy, etag) or None
+    when the index isn't ready.
+    """
+    # One snapshot, so results are always cached under their own index's version
+    index = _index
+    if index is None:
+        return None
+    key = f"{index.version}|{mode}|{query.lower()}"
+    cache = get_cache('medicine_search', ttl=SEARCH_CACHE_TTL, max_entries=20000)
+    
+    found = cache.get(key)
+    if found is None:
+        found = _search_flight.do(key, lambda: search_medicines(query, mode=mode, index=index))
+        if found is None:
+            return None
+        cache.set(key, found)
+    
+    etag = hashlib.sha1(key.encode('utf-8')).hexdigest()[:20]
+    return found[0], found[1], etag
+
+
+def check_medications(medicine_names, allergies):
+    """
+    Resolve a user's medicines to ingredients and flag, without an LLM call:
+    - ingredients matching anything in their free-text allergies
+    - the same ingredient appearing in more than one medicine
+    Returns a short list of human-readable findings, or None while the
+    index isn't built yet (so callers don't cache "no findings").
+    """
+    index = _index
+    if index is None:
+        return None
+
+    allergy_terms = {
+        ' '.join(term.split()) for term in re.split(r'[,;/\n]|\band\b', (allergies or '').lower())
+        if len(term.strip()) >= 3 and term.strip() not in ('none', 'nil', 'no', 'n/a')
+    }
+
+    findings = []
+    by_ingredient = {}
+    unique_names = {' '.join(n.lower().split()): n.strip() for n in medicine_names if n and n.strip()}
+    for name in unique_names.values():
+        for ingredient in index.resolve_ingredients(name):
+            by_ingredient.setdefault(ingredient, []).append(name)
+            for term in allergy_terms:
+                if term in ingredient or ingredient in term:
+                    findings.append(f"ALLERGY: {name} contains {ingredient} (listed allergy: {term})")
+
+    for ingredient, names in sorted(by_ingredient.items()):
+        if len(set(names)) > 1:
+            findings.append(f"DUPLICATE: {ingredient} is in {', '.join(sorted(set(names)))}")
+
+    return findings[:MAX_MEDICATION_CHECKS]
+
+
+def start_background_refresh():
+    """
+    Build the index now, then check the catalogue version every
+    INDEX_REFRESH_SECONDS and rebuild only when an import changed it.
+    """
+    def loop():
+        while True:
+            try:
+                refresh_medicine_index(force=False)
+            except Exception:
+                logger.exception("Medicine index refresh failed")
+            time.sleep(INDEX_REFRESH_SECONDS)
+
+    threading.Thread(target=loop, name='medicine-index', daemon=True).start()
@@ -0,0 +1,125 @@
+"""
+Sage - OTP Store
+Pluggable storage for one-time passwords:
+- MemoryOTPStore: process-local, size-capped, swept in the background
+- DatabaseOTPStore: otp_codes table, shared by every worker
+Only a hash of each OTP is kept. Checks compare in constant time and
+an OTP is discarded after OTP_MAX_ATTEMPTS wrong guesses.
+"""
+
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from database import save_otp_code, check_otp_code, delete_expired_otp_codes
+from logs import get_logger
+
+logger = get_logger(__name__)
+
+# OTP configuration from environment
+OTP_STORE = os.environ.get('OTP_STORE', 'memory')  # 'memory' or 'database'
+OTP_TTL_SECONDS = int(os.environ.get('OTP_TTL_SECONDS', 600))
+OTP_MAX_ATTEMPTS = int(os.environ.get('OTP_MAX_ATTEMPTS', 5))
+OTP_MAX_ENTRIES = int(os.environ.get('OTP_MAX_ENTRIES', 10000))
+OTP_SWEEP_INTERVAL = int(os.environ.get('OTP_SWEEP_INTERVAL', 60))
+
+# check() results
+OK, MISSING, EXPIRED, INVALID, LOCKED = 'ok', 'missing', 'expired', 'invalid', 'locked'
+
+
+def hash_otp(key, otp):
+    return hashlib.sha256(f"{key}:{otp}".encode('utf-8')).hexdigest()
+
+
+class MemoryOTPStore:
+    """Process-local OTPs. Oldest entries are evicted past max_entries."""
+
+    def __init__(self, ttl=OTP_TTL_SECONDS, max_attempts=OTP_MAX_ATTEMPTS, max_entries=OTP_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+        self.max_entries = max_entries
+        self._data = OrderedDict()   # key -> [otp_hash, expires_at, attempts]; oldest first
+        self._lock = threading.Lock()
+
+    def put(self, key, otp):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = [hash_otp(key, otp), time.time() + self.ttl, 0]
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+        return True
+
+    def check(self, key, otp):
+        """Verify and consume an OTP. Returns one of OK/MISSING/EXPIRED/INVALID/LOCKED."""
+        candidate = hash_otp(key, otp)
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return MISSING
+            if time.time() > entry[1]:
+                del self._data[key]
+                return EXPIRED
+            if hmac.compare_digest(entry[0], candidate):
+                del self._data[key]
+                return OK
+            entry[2] += 1
+            if entry[2] >= self.max_attempts:
+                del self._data[key]
+                return LOCKED
+            return INVALID
+
+    def sweep(self):
+        """Drop expired entries. Returns how many were removed."""
+        now = time.time()
+        with self._lock:
+            expired = [key for key, entry in self._data.items() if now > entry[1]]
+            for key in expired:
+                del self._data[key]
+        return len(expired)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class DatabaseOTPStore:
+    """OTPs in the otp_codes table, so any worker can verify them."""
+
+    def __init__(self, ttl=OTP_TTL_SECONDS, max_attempts=OTP_MAX_ATTEMPTS):
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+
+    def put(self, key, otp):
+        return save_otp_code(key, hash_otp(key, otp), self.ttl)
+
+    def check(self, key, otp):
+        result = check_otp_code(key, hash_otp(key, otp), self.max_attempts)
+        return result or MISSING
+
+    def sweep(self):
+        return delete_expired_otp_codes() or 0
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_otp_store():
+    """Return the configured store, starting its expiry sweep on first use."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = DatabaseOTPStore() if OTP_STORE == 'database' else MemoryOTPStore()
+            threading.Thread(target=_sweep_forever, args=(_store,), name='otp-sweeper', daemon=True).start()
+        return _store
+
+
+def _sweep_forever(store):
+    while True:
+        time.sleep(OTP_SWEEP_INTERVAL)
+        try:
+            store.sweep()
+        except Exception as e:
+            logger.error("OTP sweep error: %s", e)
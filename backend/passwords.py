@@ -0,0 +1,104 @@
+"""
+Sage - Password Hashing
+bcrypt runs on a small dedicated thread pool (bcrypt releases the GIL
+while hashing) instead of on request threads. At most
+PASSWORD_HASH_MAX_PENDING calls may be running or queued; beyond that
+callers get PasswordHasherBusy straight away, so a login storm can't
+occupy every request thread. By default that limit leaves two of the
+WEB_THREADS request threads free for other routes.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
+
+import bcrypt
+
+# Hashing configuration from environment
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+WEB_THREADS = int(os.environ.get('WEB_THREADS', 8))  # gunicorn --threads
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', min(4, os.cpu_count() or 1)))
+PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING',
+                                               max(PASSWORD_HASH_WORKERS, WEB_THREADS - 2)))
+PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 10))
+PASSWORD_HASH_RETRY_AFTER = 2  # seconds suggested to shed callers
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when the hashing queue is full or a hash timed out waiting for it."""
+
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix='bcrypt')
+_slots_lock = threading.Lock()
+_pending = 0   # hashes running or queued on _executor
+_stats = {'completed': 0, 'rejected': 0, 'timed_out': 0}
+
+
+def _acquire_slot():
+    global _pending
+    with _slots_lock:
+        if _pending >= PASSWORD_HASH_MAX_PENDING:
+            _stats['rejected'] += 1
+            return False
+        _pending += 1
+        return True
+
+
+def _release_slot(_future=None):
+    global _pending
+    with _slots_lock:
+        _pending -= 1
+
+
+def _run(fn, *args):
+    if not _acquire_slot():
+        raise PasswordHasherBusy("Password hashing queue is full")
+    try:
+        future = _executor.submit(fn, *args)
+    except BaseException:
+        _release_slot()
+        raise
+    # The slot is freed when bcrypt finishes, not when this caller stops waiting
+    future.add_done_callback(_release_slot)
+    try:
+        result = future.result(timeout=PASSWORD_HASH_TIMEOUT)
+    except FuturesTimeout:
+        future.cancel()  # drops it if it never started
+        _stats['timed_out'] += 1
+        raise PasswordHasherBusy("Password hashing timed out")
+    _stats['completed'] += 1
+    return result
+
+
+def _hash(password):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode('utf-8')
+
+
+def _check(password, hashed):
+    try:
+        return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+    except ValueError:  # malformed stored hash
+        return False
+
+
+def hash_password(password):
+    """Return the bcrypt hash of password as a string."""
+    return _run(_hash, password)
+
+
+def check_password(password, hashed):
+    """Check password against a stored bcrypt hash."""
+    if not hashed:
+        return False
+    return _run(_check, password, hashed)
+
+
+def get_hasher_stats():
+    return {
+        'workers': PASSWORD_HASH_WORKERS,
+        'max_pending': PASSWORD_HASH_MAX_PENDING,
+        'pending': _pending,
+        'completed': _stats['completed'],
+        'rejected': _stats['rejected'],
+        'timed_out': _stats['timed_out'],
+    }
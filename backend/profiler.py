@@ -0,0 +1,98 @@
+"""
+Sage - Sampling Profiler
+On-demand wall-clock sampler for a running worker. Every PROFILE_INTERVAL
+seconds it records the stack of every thread; after the requested
+duration the counts are written as collapsed stacks ("a;b;c 42" per
+line), the input format of flamegraph.pl, inferno and speedscope.
+Only the worker that receives the admin request is profiled.
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from logs import get_logger
+
+logger = get_logger(__name__)
+
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'sage-profiles'))
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', 0.01))
+PROFILE_MAX_SECONDS = int(os.environ.get('PROFILE_MAX_SECONDS', 120))
+
+_lock = threading.Lock()
+_status = {'running': False}
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _collapse(thread_name, frame):
+    """Root-first stack for one thread, prefixed with the thread name."""
+    stack = []
+    while frame is not None:
+        stack.append(_frame_label(frame))
+        frame = frame.f_back
+    stack.append(thread_name.replace(';', '_').replace(' ', '_'))
+    return ';'.join(reversed(stack))
+
+
+def _sample(seconds, interval, path):
+    own_ident = threading.get_ident()
+    counts = Counter()
+    samples = 0
+    deadline = time.monotonic() + seconds
+    try:
+        while time.monotonic() < deadline:
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident != own_ident:
+                    counts[_collapse(names.get(ident, f"thread-{ident}"), frame)] += 1
+            samples += 1
+            time.sleep(interval)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in counts.most_common():
+                f.write(f"{stack} {count}\n")
+        error = None
+    except Exception as e:
+        logger.error("Profiler error: %s", e)
+        error = str(e)
+
+    with _lock:
+        _status.update(running=False, samples=samples, stacks=len(counts), error=error,
+                       finished_at=datetime.now().isoformat())
+
+
+def start_profile(seconds, interval=PROFILE_INTERVAL):
+    """
+    Sample this process for `seconds` (capped at PROFILE_MAX_SECONDS) in a
+    background thread. Returns the new status, or None if one is running.
+    """
+    seconds = max(1, min(int(seconds), PROFILE_MAX_SECONDS))
+    with _lock:
+        if _status['running']:
+            return None
+        started = datetime.now()
+        filename = f"sage-{os.getpid()}-{started.strftime('%Y%m%d-%H%M%S')}.folded"
+        _status.clear()
+        _status.update(running=True, started_at=started.isoformat(), seconds=seconds,
+                       interval=interval, pid=os.getpid(), filename=filename)
+        status = dict(_status)
+
+    thread = threading.Thread(target=_sample, args=(seconds, interval, os.path.join(PROFILE_DIR, filename)),
+                              name='sampling-profiler', daemon=True)
+    thread.start()
+    return status
+
+
+def get_profile_status():
+    """The running or most recent profile in this process."""
+    with _lock:
+        return dict(_status)
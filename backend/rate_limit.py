@@ -0,0 +1,146 @@
+"""
+Sage - Rate Limiting
+Token buckets for abuse-prone endpoints (OTP sends, logins). Each rule
+has a bucket per key (email, client IP, user); a call is shed when any
+of its buckets is empty. Buckets live in-process, or in Redis when
+RATE_LIMIT_STORE=redis so every worker shares them.
+"""
+
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from cache import get_shared_client
+from logs import get_logger
+
+logger = get_logger(__name__)
+
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+RATE_LIMIT_STORE = os.environ.get('RATE_LIMIT_STORE', 'local')  # 'local' or 'redis'
+RATE_LIMIT_MAX_BUCKETS = int(os.environ.get('RATE_LIMIT_MAX_BUCKETS', 50000))
+
+# rule -> key kind -> (capacity, seconds per token)
+RATE_LIMITS = {
+    'otp_send': {
+        'email': (3, 60),       # burst of 3, then one OTP a minute per address
+        'ip': (10, 30),
+        'user': (5, 60),
+    },
+    'login': {
+        'email': (5, 60),       # bounds bcrypt work spent on one account
+        'ip': (20, 3),
+        'user': (10, 30),
+    },
+}
+
+_shed = Counter()       # (rule, key kind) -> calls rejected
+_allowed = Counter()    # rule -> calls let through
+
+
+class LocalBucketStore:
+    """Process-local buckets; least recently used keys are evicted past max_buckets."""
+
+    def __init__(self, max_buckets=RATE_LIMIT_MAX_BUCKETS):
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict()   # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, interval):
+        """Take one token. Returns 0 if allowed, else seconds until a token is available."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) / interval)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                retry_after = 0
+            else:
+                self._buckets[key] = (tokens, now)
+                retry_after = (1 - tokens) * interval
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        return retry_after
+
+
+# Same refill arithmetic as LocalBucketStore, run atomically in Redis
+_REDIS_TAKE = """
+local capacity = tonumber(ARGV[1])
+local interval = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) / interval)
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    retry_after = (1 - tokens) * interval
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity * interval))
+return tostring(retry_after)
+"""
+
+
+class RedisBucketStore:
+    """Buckets shared across workers. Falls back to local buckets if Redis fails."""
+
+    def __init__(self, client):
+        self.client = client
+        self.script = client.register_script(_REDIS_TAKE)
+        self.fallback = LocalBucketStore()
+
+    def take(self, key, capacity, interval):
+        try:
+            return float(self.script(keys=[f"sage:ratelimit:{key}"], args=[capacity, interval, time.time()]))
+        except Exception as e:
+            logger.warning("Shared rate limit store unavailable, using local buckets: %s", e)
+            return self.fallback.take(key, capacity, interval)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def _get_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            client = get_shared_client() if RATE_LIMIT_STORE == 'redis' else None
+            _store = RedisBucketStore(client) if client is not None else LocalBucketStore()
+        return _store
+
+
+def check_rate_limit(rule, **keys):
+    """
+    Take a token from each bucket of `rule` for the given keys, e.g.
+    check_rate_limit('login', email=email, ip=ip). Keys that are None are skipped.
+    Returns 0 if the call may proceed, else the Retry-After in whole seconds.
+    """
+    if not RATE_LIMIT_ENABLED:
+        return 0
+    store = _get_store()
+    retry_after = 0
+    for kind, value in keys.items():
+        if value is None or kind not in RATE_LIMITS[rule]:
+            continue
+        capacity, interval = RATE_LIMITS[rule][kind]
+        wait = store.take(f"{rule}:{kind}:{str(value).lower()}", capacity, interval)
+        if wait > 0:
+            _shed[(rule, kind)] += 1
+            retry_after = max(retry_after, wait)
+    if retry_after:
+        return max(1, int(retry_after + 0.999))
+    _allowed[rule] += 1
+    return 0
+
+
+def get_rate_limit_stats():
+    """Allowed and shed call counts, for metrics."""
+    return {
+        'allowed': dict(_allowed),
+        'shed': {f"{rule}:{kind}": count for (rule, kind), count in _shed.items()},
+    }
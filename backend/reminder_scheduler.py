@@ -0,0 +1,287 @@
+"""
+Sage - Medication Reminder Scheduler
+Keeps every active user_medications time slot in a timing wheel with one
+bucket per UTC minute of the day. Each minute tick pops a single bucket,
+so firing is O(1) amortized regardless of how many reminders exist:
+- 'due' entries record a due-dose event for the user
+- 'missed' entries (MISSED_AFTER_MINUTES later) mark still-unlogged
+  slots as missed in medication_logs, batched into one write per tick
+Slot times and log dates are in the user's own timezone (users.timezone,
+reported by their browser). Users without a known timezone are not put
+on the wheel; their page falls back to local reminder checks.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import date, datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from database import (
+    get_active_medication_schedules, get_medication_schedule, mark_missed_medication_slots,
+    update_user_timezone
+)
+from logs import get_logger
+
+logger = get_logger(__name__)
+
+MINUTES_PER_DAY = 24 * 60
+MISSED_AFTER_MINUTES = int(os.environ.get('REMINDER_MISSED_AFTER_MINUTES', 60))
+MAX_DUE_EVENTS_PER_USER = 50
+SCHEDULER_ENABLED = os.environ.get('REMINDER_SCHEDULER_ENABLED', 'true').lower() == 'true'
+
+# Offsets are re-checked this often so DST changes move slots to the right UTC minute
+OFFSET_CHECK_MINUTES = 15
+
+_lock = threading.Lock()
+_wheel = [dict() for _ in range(MINUTES_PER_DAY)]   # UTC minute -> {(med_id, time_slot, kind): None}
+_medications = {}                                   # med_id -> schedule dict incl. wheel slots
+_due_events = {}                                    # user_id -> deque of recent due-dose events
+_user_timezones = {}                                # user_id -> IANA timezone name (or None)
+_started = False
+_loaded = False
+
+
+def _minute_of(time_slot):
+    """'08:30' -> 510, or None if unparseable."""
+    try:
+        hours, minutes = time_slot.split(':')[:2]
+        value = int(hours) * 60 + int(minutes)
+        return value if 0 <= value < MINUTES_PER_DAY else None
+    except (AttributeError, ValueError):
+        return None
+
+
+def _parse_times(times):
+    if isinstance(times, str):
+        try:
+            times = json.loads(times)
+        except ValueError:
+            return []
+    return [t for t in (times or []) if _minute_of(t) is not None]
+
+
+def _zone(name):
+    """ZoneInfo for an IANA name, or None if missing or unknown."""
+    if not name:
+        return None
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
+
+
+def local_today(timezone_name):
+    """Today in an IANA timezone (the date missed slots are logged under), else the server's date."""
+    tz = _zone(timezone_name)
+    return datetime.now(tz).date() if tz else date.today()
+
+
+def _offset_minutes(tz, at):
+    return int(at.astimezone(tz).utcoffset().total_seconds() // 60)
+
+
+def _is_scheduled_on(med, day):
+    """Alternate-day medicines run on even day offsets from creation."""
+    if med.get('frequency') != 'Alternate' or not med.get('created_local'):
+        return True
+    return (day - med['created_local'].date()).days % 2 == 0
+
+
+# ============== INCREMENTAL UPDATES ==============
+
+def schedule_medication(med):
+    """
+    Insert or replace one medication's slots. med is a user_medications row
+    plus the owner's `timezone`; without a valid timezone it isn't scheduled.
+    """
+    tz = _zone(med.get('timezone'))
+    now = datetime.now(timezone.utc)
+    with _lock:
+        _remove_locked(med['id'])
+        _user_timezones[med['user_id']] = med.get('timezone') if tz else None
+        if not med.get('active', True) or tz is None:
+            return
+        offset = _offset_minutes(tz, now)
+        slots = []
+        for time_slot in _parse_times(med.get('times')):
+            minute = (_minute_of(time_slot) - offset) % MINUTES_PER_DAY
+            due_key = (med['id'], time_slot, 'due')
+            missed_key = (med['id'], time_slot, 'missed')
+            missed_minute = (minute + MISSED_AFTER_MINUTES) % MINUTES_PER_DAY
+            _wheel[minute][due_key] = None
+            _wheel[missed_minute][missed_key] = None
+            slots.append((minute, due_key))
+            slots.append((missed_minute, missed_key))
+        # created_at is a naive server-local DATETIME; compare it in the user's zone
+        created_local = med['created_at'].astimezone(tz).replace(tzinfo=None) if med.get('created_at') else None
+        _medications[med['id']] = dict(med, slots=slots, tz=tz, offset=offset, created_local=created_local)
+
+
+def unschedule_medication(med_id):
+    """Remove a medication's slots from the wheel."""
+    with _lock:
+        _remove_locked(med_id)
+
+
+def reschedule_medication(med_id):
+    """Reload one medication from the database after it was added or edited."""
+    if not _started:
+        return
+    med = get_medication_schedule(med_id)
+    if med:
+        schedule_medication(med)
+    else:
+        unschedule_medication(med_id)
+
+
+def set_user_timezone(user_id, timezone_name):
+    """
+    Record the timezone a user's browser reports, rescheduling their
+    medicines when it changes. Returns True if the user is now scheduled
+    in a known timezone.
+    """
+    if _zone(timezone_name) is None:
+        with _lock:
+            return _user_timezones.get(user_id) is not None
+    with _lock:
+        if _user_timezones.get(user_id) == timezone_name:
+            return True
+    if not update_user_timezone(user_id, timezone_name):
+        return False
+    with _lock:
+        _user_timezones[user_id] = timezone_name
+    if _started:
+        for med in get_active_medication_schedules(user_id) or []:
+            schedule_medication(med)
+    return True
+
+
+def _rebalance_offsets(now):
+    """Move medications whose timezone offset changed (DST) to their new UTC minutes."""
+    with _lock:
+        changed = [med for med in _medications.values() if _offset_minutes(med['tz'], now) != med['offset']]
+    for med in changed:
+        schedule_medication(med)
+
+
+def _remove_locked(med_id):
+    existing = _medications.pop(med_id, None)
+    if existing:
+        for minute, key in existing['slots']:
+            _wheel[minute].pop(key, None)
+
+
+# ============== DUE EVENTS ==============
+
+def pop_due_events(user_id):
+    """Return and clear the due-dose events recorded for a user."""
+    with _lock:
+        events = _due_events.pop(user_id, None)
+    return list(events) if events else []
+
+
+def _record_due(med, time_slot, day):
+    events = _due_events.setdefault(med['user_id'], deque(maxlen=MAX_DUE_EVENTS_PER_USER))
+    events.append({
+        'medication_id': med['id'],
+        'medicine_name': med.get('medicine_name'),
+        'dosage': med.get('dosage'),
+        'time_slot': time_slot,
+        'date': day.isoformat(),
+    })
+
+
+# ============== TICKING ==============
+
+def _process_minute(minute, tick):
+    """Fire one wheel bucket (tick is its UTC time). Missed slots are written in a single batch."""
+    missed_rows = []
+    with _lock:
+        for med_id, time_slot, kind in list(_wheel[minute]):
+            med = _medications.get(med_id)
+            if not med:
+                continue
+            # The dose's day in the user's zone; a missed check belongs to the dose before it
+            local = tick.astimezone(med['tz'])
+            if kind == 'missed':
+                local -= timedelta(minutes=MISSED_AFTER_MINUTES)
+            day = local.date()
+            if not _is_scheduled_on(med, day):
+                continue
+            # Don't mark doses that were due before the medicine was added
+            due_at = datetime.combine(day, datetime.min.time()) + timedelta(minutes=_minute_of(time_slot))
+            if kind == 'missed' and med['created_local'] and med['created_local'] > due_at:
+                continue
+            if kind == 'due':
+                _record_due(med, time_slot, day)
+            else:
+                missed_rows.append((med['user_id'], med_id, day.isoformat(), time_slot))
+
+    if missed_rows:
+        marked = mark_missed_medication_slots(missed_rows)
+        if marked is not None:
+            logger.info("Reminder scheduler: %s of %s slots marked missed", marked, len(missed_rows))
+
+
+def _load_schedules():
+    """Load every active medication into the wheel. Returns False if the database read failed."""
+    global _loaded
+    schedules = get_active_medication_schedules()
+    if schedules is None:
+        logger.warning("Reminder scheduler: could not load medications, retrying next minute")
+        return False
+    for med in schedules:
+        schedule_medication(med)
+    _loaded = True
+    logger.info("Reminder scheduler: %s medications loaded", len(schedules))
+    return True
+
+
+def _run():
+    last = None
+    while True:
+        now = datetime.now(timezone.utc)
+        current = now.hour * 60 + now.minute
+        if last is None:
+            last = current - 1
+        try:
+            if not _loaded:
+                _load_schedules()
+            elif current % OFFSET_CHECK_MINUTES == 0:
+                _rebalance_offsets(now)
+        except Exception:
+            logger.exception("Reminder scheduler error")
+        # Catch up on any minutes skipped while the process was busy or asleep
+        steps = (current - last) % MINUTES_PER_DAY
+        for step in range(1, steps + 1):
+            try:
+                _process_minute((last + step) % MINUTES_PER_DAY, now - timedelta(minutes=steps - step))
+            except Exception:
+                logger.exception("Reminder scheduler error")
+        last = current
+        time.sleep(60 - datetime.now().second + 0.05)
+
+
+def start_scheduler():
+    """Load all active medications into the wheel and start ticking."""
+    global _started
+    if _started or not SCHEDULER_ENABLED:
+        return
+    _started = True
+    threading.Thread(target=_run, name='reminder-scheduler', daemon=True).start()
+
+
+def is_running():
+    return _started
+
+
+def get_scheduler_stats():
+    with _lock:
+        return {
+            'medications': len(_medications),
+            'slots': sum(len(m['slots']) for m in _medications.values()) // 2,
+            'users_with_due_events': len(_due_events),
+        }
@@ -0,0 +1,116 @@
+"""
+Sage - Response Encoding
+orjson-backed JSON for Flask (datetimes and dates serialize natively as
+ISO 8601, so routes don't convert them by hand) and gzip/brotli
+compression of JSON and HTML responses negotiated from Accept-Encoding.
+Falls back to Flask's encoder and gzip-only when orjson/brotli are
+not installed.
+"""
+
+import gzip
+import os
+from datetime import date
+from decimal import Decimal
+
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # Flask's stdlib-json provider is used without it
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+COMPRESSIBLE_MIMETYPES = ('application/json', 'text/html', 'text/plain')
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5   # dynamic responses: fast, still smaller than gzip
+
+
+def _default(obj):
+    # Same as Flask's default encoder for the types orjson doesn't know
+    if isinstance(obj, Decimal):
+        return str(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps_json(obj, sort_keys=False):
+    """Serialize obj to JSON bytes."""
+    option = orjson.OPT_NON_STR_KEYS
+    if sort_keys:
+        option |= orjson.OPT_SORT_KEYS
+    return orjson.dumps(obj, default=_default, option=option)
+
+
+class IsoJSONProvider(DefaultJSONProvider):
+    """Stdlib fallback that still writes dates as ISO 8601, like orjson."""
+
+    @staticmethod
+    def default(obj):
+        if isinstance(obj, date):
+            return obj.isoformat()
+        return DefaultJSONProvider.default(obj)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider using orjson for jsonify() and request.json."""
+
+    sort_keys = False
+
+    def dumps(self, obj, **kwargs):
+        return dumps_json(obj, sort_keys=kwargs.get('sort_keys', self.sort_keys)).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps_json(obj, self.sort_keys), mimetype=self.mimetype)
+
+
+def choose_encoding(accept_encodings):
+    """Best of br/gzip the client accepts, or None."""
+    br = accept_encodings['br'] if brotli is not None else 0
+    gz = accept_encodings['gzip']
+    if br and br >= gz:
+        return 'br'
+    return 'gzip' if gz else None
+
+
+def compress_body(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def compress_response(response):
+    """after_request hook: compress sizeable JSON/HTML bodies the client can decode."""
+    if (response.direct_passthrough
+            or response.is_streamed
+            or not 200 <= response.status_code < 300
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_BYTES:
+        return response
+    
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding:
+        response.set_data(compress_body(body, encoding))
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def install_response_encoding(app):
+    """Install the fast JSON provider and response compression on a Flask app."""
+    app.json = FastJSONProvider(app) if orjson is not None else IsoJSONProvider(app)
+    app.after_request(compress_response)
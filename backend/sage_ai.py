@@ -4,80 +4,206 @@ Handles AI-powered health conversations using Claude API and mathematical embedd
 """
 
 import anthropic
+import asyncio
 import base64
 import os
 import json
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 import numpy as np
 from sentence_transformers import SentenceTransformer
 from sklearn.metrics.pairwise import cosine_similarity
 
+from metrics import EMBEDDING_SECONDS, RETRIEVAL_SCORE, ANTHROPIC_SECONDS, ANTHROPIC_TOKENS
+from tracing import span, traced
+from logs import get_logger
+
+logger = get_logger(__name__)
+
 ANTHROPIC_API_KEY = os.environ.get('ANTHROPIC_API_KEY', '')
+CLAUDE_MODEL = "claude-sonnet-4-20250514"
+
+# One async client for the ASGI routes, created on first use inside the event loop
+_async_client = None
+
+
+def _get_async_client():
+    global _async_client
+    if _async_client is None:
+        _async_client = anthropic.AsyncAnthropic(api_key=ANTHROPIC_API_KEY)
+    return _async_client
+
+
+@contextmanager
+def _anthropic_call(call):
+    """Time one messages.create call for /metrics and the request trace."""
+    with ANTHROPIC_SECONDS.time(call=call), span('anthropic.messages.create', call=call):
+        yield
+
+
+def _record_usage(call, response):
+    usage = getattr(response, 'usage', None)
+    if usage is not None:
+        ANTHROPIC_TOKENS.observe(usage.input_tokens, call=call, direction='input')
+        ANTHROPIC_TOKENS.observe(usage.output_tokens, call=call, direction='output')
+
+# Rendered system prompts keyed by profile fingerprint, shared by all instances
+PROMPT_CACHE_SIZE = int(os.environ.get('PROMPT_CACHE_SIZE', 256))
+_prompt_cache = OrderedDict()
+_prompt_cache_lock = threading.Lock()
+_prompt_stats = {'rebuilds': 0, 'skipped_same_profile': 0, 'shared_cache_hits': 0}
+
+
+def profile_fingerprint(profile):
+    """Stable hash of a profile dict, independent of key order."""
+    payload = json.dumps(profile or {}, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def get_prompt_cache_stats():
+    """Counters showing how many system prompt rebuilds were avoided."""
+    with _prompt_cache_lock:
+        return dict(_prompt_stats, cache_size=len(_prompt_cache))
+
+
+# Conversation memory limits for what is sent to the model
+HISTORY_MAX_MESSAGES = 20
+HISTORY_TOKEN_BUDGET = int(os.environ.get('HISTORY_TOKEN_BUDGET', 4000))
+
+# Embedding model and vector store are loaded once and shared by every SageAI
+_engine_state = None
+_engine_lock = threading.Lock()
+
+
+def _load_knowledge_base():
+    """Loads the verified medical data."""
+    try:
+        base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        kb_path = os.path.join(base_dir, 'data', 'health_knowledge.JSON')
+        with open(kb_path, 'r') as file:
+            return json.load(file)
+    except Exception as e:
+        logger.error("Failed to load knowledge base: %s", e)
+        return {"topics": []}
+
+
+def _build_vector_store(embedder, knowledge_base):
+    """Converts the JSON text into Mathematical Vectors (Embeddings)"""
+    topic_texts = []
+    topic_data = []
+
+    for topic in knowledge_base.get("topics", []):
+        text_to_embed = f"{topic['name']}. Keywords: {' '.join(topic.get('keywords', []))}"
+        topic_texts.append(text_to_embed)
+        topic_data.append(topic)
+
+    if topic_texts:
+        logger.info("Encoding knowledge base into vectors")
+        topic_embeddings = embedder.encode(topic_texts)
+    else:
+        topic_embeddings = []
+    return topic_texts, topic_data, topic_embeddings
+
+
+def _get_engine_state():
+    """Load the embedding model and knowledge base vectors on first use."""
+    global _engine_state
+    with _engine_lock:
+        if _engine_state is None:
+            # Load the Semantic Embedding Model (Lightweight, perfect for Cloud Run)
+            logger.info("Loading semantic vector model (MiniLM)")
+            embedder = SentenceTransformer('all-MiniLM-L6-v2')
+            knowledge_base = _load_knowledge_base()
+            topic_texts, topic_data, topic_embeddings = _build_vector_store(embedder, knowledge_base)
+            _engine_state = {
+                'embedder': embedder,
+                'knowledge_base': knowledge_base,
+                'topic_texts': topic_texts,
+                'topic_data': topic_data,
+                'topic_embeddings': topic_embeddings,
+            }
+        return _engine_state
+
+
+def warm_up_engine():
+    """Load the embedding model now rather than inside the first chat request."""
+    _get_engine_state()
+
+
+def estimate_tokens(text):
+    """Rough token estimate (~4 characters per token) for history budgeting."""
+    return len(text) // 4 + 1
+
 
 class SageAI:
     def __init__(self):
-        """Initialize Sage AI with Claude API and load Vector knowledge base."""
+        """Initialize Sage AI with Claude API and the shared Vector knowledge base."""
         self.client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
         self.conversation_history = []
         self.user_profile = None
+        self._profile_fingerprint = None
         
-        # Load the Semantic Embedding Model (Lightweight, perfect for Cloud Run)
-        print("Loading Semantic Vector Model (MiniLM)...")
-        self.embedder = SentenceTransformer('all-MiniLM-L6-v2')
-        
-        # Load JSON and build the In-Memory Vector Store
-        self.knowledge_base = self._load_knowledge_base()
-        self._build_vector_store()
+        engine = _get_engine_state()
+        self.embedder = engine['embedder']
+        self.knowledge_base = engine['knowledge_base']
+        self.topic_texts = engine['topic_texts']
+        self.topic_data = engine['topic_data']
+        self.topic_embeddings = engine['topic_embeddings']
         
         self.system_prompt_base = self._build_base_system_prompt()
-    
-    def _load_knowledge_base(self):
-        """Loads the verified medical data."""
-        try:
-            base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-            kb_path = os.path.join(base_dir, 'data', 'health_knowledge.JSON')
-            with open(kb_path, 'r') as file:
-                return json.load(file)
-        except Exception as e:
-            print(f"Failed to load knowledge base: {e}")
-            return {"topics": []}
-
-    def _build_vector_store(self):
-        """Converts the JSON text into Mathematical Vectors (Embeddings)"""
-        self.topic_texts = []
-        self.topic_data = []
-        
-        for topic in self.knowledge_base.get("topics", []):
-            text_to_embed = f"{topic['name']}. Keywords: {' '.join(topic.get('keywords', []))}"
-            self.topic_texts.append(text_to_embed)
-            self.topic_data.append(topic)
-            
-        if self.topic_texts:
-            print("Encoding Knowledge Base into Vectors...")
-            self.topic_embeddings = self.embedder.encode(self.topic_texts)
-        else:
-            self.topic_embeddings = []
 
+    @traced('sage.retrieve_context')
     def _retrieve_context(self, user_message):
         """Vector RAG Retrieval: Finds context using Cosine Similarity."""
         if len(self.topic_texts) == 0:
             return []
 
-        user_embedding = self.embedder.encode([user_message])
+        with EMBEDDING_SECONDS.time(), span('sage.embed'):
+            user_embedding = self.embedder.encode([user_message])
         similarities = cosine_similarity(user_embedding, self.topic_embeddings)[0]
         
         best_idx = np.argmax(similarities)
         best_score = similarities[best_idx]
+        RETRIEVAL_SCORE.observe(float(best_score))
         
         if best_score > 0.40:
-            print(f"Vector Match Found: {self.topic_data[best_idx]['name']} (Confidence: {round(best_score*100, 2)}%)")
+            logger.info("Vector match found: %s", self.topic_data[best_idx]['name'],
+                        extra={'event': 'vector_match', 'confidence': round(float(best_score), 4)})
             return [self.topic_data[best_idx]]
             
         return []
 
     def set_user_profile(self, profile):
         """Set user profile for personalized responses."""
+        fingerprint = profile_fingerprint(profile)
+        if fingerprint == self._profile_fingerprint:
+            with _prompt_cache_lock:
+                _prompt_stats['skipped_same_profile'] += 1
+            return
+
         self.user_profile = profile
-        self.system_prompt_base = self._build_base_system_prompt()
+        self._profile_fingerprint = fingerprint
+
+        with _prompt_cache_lock:
+            cached = _prompt_cache.get(fingerprint)
+            if cached is not None:
+                _prompt_cache.move_to_end(fingerprint)
+                _prompt_stats['shared_cache_hits'] += 1
+        if cached is not None:
+            self.system_prompt_base = cached
+            return
+
+        prompt = self._build_base_system_prompt()
+        with _prompt_cache_lock:
+            _prompt_stats['rebuilds'] += 1
+            # Identical profiles across users share one rendered copy
+            prompt = _prompt_cache.setdefault(fingerprint, prompt)
+            _prompt_cache.move_to_end(fingerprint)
+            while len(_prompt_cache) > PROMPT_CACHE_SIZE:
+                _prompt_cache.popitem(last=False)
+        self.system_prompt_base = prompt
     
     def _build_base_system_prompt(self):
         """Build the static part of the system prompt."""
@@ -97,6 +223,11 @@ class SageAI:
 
 Use this to personalize responses. Never recommend anything they're allergic to. Consider drug interactions.
 """
+            checks = self.user_profile.get('medication_checks')
+            if checks:
+                user_context += "\n## PRECOMPUTED MEDICATION CHECKS (from our medicine database)\n"
+                user_context += "\n".join(f"- {check}" for check in checks)
+                user_context += "\nRaise these gently if relevant, and never suggest products containing these allergens.\n"
         
         return f"""You are Sage, a friendly health assistant who chats like a caring friend, NOT a doctor or textbook.
 
@@ -117,10 +248,8 @@ Use this to personalize responses. Never recommend anything they're allergic to.
 {user_context}
 """
 
-    def chat(self, user_message):
-        """Process user message using Vector RAG and get AI response."""
-        retrieved_topics = self._retrieve_context(user_message)
-        
+    def _prepare_chat(self, user_message, retrieved_topics):
+        """Add the user turn to history and return the system prompt for it."""
         rag_context = ""
         if retrieved_topics:
             rag_context = "\n\n## RETRIEVED MEDICAL KNOWLEDGE (Use this safely to anchor your response):\n"
@@ -130,35 +259,90 @@ Use this to personalize responses. Never recommend anything they're allergic to.
                 rag_context += f"- Safe Home Remedies: {', '.join(topic['home_remedies'])}\n"
                 rag_context += f"- When to see a doctor: {', '.join(topic['when_to_see_doctor'])}\n"
         
-        dynamic_system_prompt = self.system_prompt_base + rag_context
-        
         self.conversation_history.append({"role": "user", "content": user_message})
-        if len(self.conversation_history) > 20:
-            self.conversation_history = self.conversation_history[-20:]
+        if len(self.conversation_history) > HISTORY_MAX_MESSAGES:
+            self.conversation_history = self.conversation_history[-HISTORY_MAX_MESSAGES:]
+        
+        return self.system_prompt_base + rag_context
+    
+    def _record_reply(self, response, call):
+        _record_usage(call, response)
+        assistant_message = response.content[0].text
+        self.conversation_history.append({"role": "assistant", "content": assistant_message})
+        return assistant_message
+    
+    def chat(self, user_message):
+        """Process user message using Vector RAG and get AI response."""
+        dynamic_system_prompt = self._prepare_chat(user_message, self._retrieve_context(user_message))
         
         try:
-            response = self.client.messages.create(
-                model="claude-sonnet-4-20250514",
-                max_tokens=256,
-                system=dynamic_system_prompt,
-                messages=self.conversation_history
-            )
+            with _anthropic_call('chat'):
+                response = self.client.messages.create(
+                    model=CLAUDE_MODEL,
+                    max_tokens=256,
+                    system=dynamic_system_prompt,
+                    messages=self.conversation_history
+                )
+            return self._record_reply(response, 'chat')
             
-            assistant_message = response.content[0].text
-            self.conversation_history.append({"role": "assistant", "content": assistant_message})
-            return assistant_message
+        except anthropic.APIError as e:
+            logger.error("Anthropic API error: %s", e)
+            return "I'm having trouble connecting right now. Please try again in a moment."
+        except Exception as e:
+            logger.error("Error in chat: %s", e)
+            return "I apologize, but I encountered an error. Please try again."
+    
+    async def achat(self, user_message):
+        """chat() for the ASGI routes: the API call is awaited, not blocking a thread."""
+        retrieved_topics = await asyncio.to_thread(self._retrieve_context, user_message)
+        dynamic_system_prompt = self._prepare_chat(user_message, retrieved_topics)
+        
+        try:
+            with _anthropic_call('chat'):
+                response = await _get_async_client().messages.create(
+                    model=CLAUDE_MODEL,
+                    max_tokens=256,
+                    system=dynamic_system_prompt,
+                    messages=self.conversation_history
+                )
+            return self._record_reply(response, 'chat')
             
         except anthropic.APIError as e:
-            print(f"Anthropic API error: {e}")
+            logger.error("Anthropic API error: %s", e)
             return "I'm having trouble connecting right now. Please try again in a moment."
         except Exception as e:
-            print(f"Error in chat: {e}")
+            logger.error("Error in chat: %s", e)
             return "I apologize, but I encountered an error. Please try again."
     
     def clear_history(self):
         self.conversation_history = []
+
+    def load_history(self, messages):
+        """
+        Replace conversation memory with the tail of a stored conversation.
+        messages: chronological chat_history rows (sender/message).
+        Keeps at most HISTORY_MAX_MESSAGES within HISTORY_TOKEN_BUDGET.
+        """
+        tail = []
+        budget = HISTORY_TOKEN_BUDGET
+        for msg in reversed(messages[-HISTORY_MAX_MESSAGES:]):
+            cost = estimate_tokens(msg['message'])
+            if tail and cost > budget:
+                break
+            budget -= cost
+            tail.append({
+                "role": "user" if msg['sender'] == 'user' else "assistant",
+                "content": msg['message']
+            })
+        tail.reverse()
+        
+        # The API expects the conversation to open with a user turn
+        while tail and tail[0]['role'] != 'user':
+            tail.pop(0)
+        self.conversation_history = tail
     
-    def analyze_image(self, image_data, file_ext, user_message=""):
+    def _prepare_image(self, image_data, file_ext, user_message):
+        """Add the image turn to history and return (system, messages) for the request."""
         base64_image = base64.b64encode(image_data).decode('utf-8')
         media_types = {'png': 'image/png', 'jpg': 'image/jpeg', 'jpeg': 'image/jpeg', 'gif': 'image/gif', 'webp': 'image/webp'}
         media_type = media_types.get(file_ext, 'image/jpeg')
@@ -173,20 +357,41 @@ Use this to personalize responses. Never recommend anything they're allergic to.
         
         self.conversation_history.append({"role": "user", "content": f"[Shared an image] {user_message}"})
         
+        system = self.system_prompt_base + "\n\n## IMAGE ANALYSIS\nDescribe what you observe clearly. Be helpful but don't diagnose."
+        return system, self.conversation_history[:-1] + [image_message]
+    
+    def analyze_image(self, image_data, file_ext, user_message=""):
+        system, messages_with_image = self._prepare_image(image_data, file_ext, user_message)
+        
         try:
-            messages_with_image = self.conversation_history[:-1] + [image_message]
-            response = self.client.messages.create(
-                model="claude-sonnet-4-20250514",
-                max_tokens=512,
-                system=self.system_prompt_base + "\n\n## IMAGE ANALYSIS\nDescribe what you observe clearly. Be helpful but don't diagnose.",
-                messages=messages_with_image
-            )
-            assistant_message = response.content[0].text
-            self.conversation_history.append({"role": "assistant", "content": assistant_message})
-            return assistant_message
+            with _anthropic_call('image'):
+                response = self.client.messages.create(
+                    model=CLAUDE_MODEL,
+                    max_tokens=512,
+                    system=system,
+                    messages=messages_with_image
+                )
+            return self._record_reply(response, 'image')
             
         except Exception as e:
-            print(f"Image analysis error: {e}")
+            logger.error("Image analysis error: %s", e)
+            return "I had trouble analyzing that image. Could you try uploading again?"
+    
+    async def aanalyze_image(self, image_data, file_ext, user_message=""):
+        system, messages_with_image = self._prepare_image(image_data, file_ext, user_message)
+        
+        try:
+            with _anthropic_call('image'):
+                response = await _get_async_client().messages.create(
+                    model=CLAUDE_MODEL,
+                    max_tokens=512,
+                    system=system,
+                    messages=messages_with_image
+                )
+            return self._record_reply(response, 'image')
+            
+        except Exception as e:
+            logger.error("Image analysis error: %s", e)
             return "I had trouble analyzing that image. Could you try uploading again?"
 
     def get_greeting(self):
@@ -204,20 +409,45 @@ def get_sage_instance(user_id, user_profile=None):
         _sage_instances[user_id].set_user_profile(user_profile)
     return _sage_instances[user_id]
 
+def switch_sage_session(user_id, history_tail, user_profile=None):
+    """Point a user's SageAI at another conversation without rebuilding it."""
+    sage = get_sage_instance(user_id, user_profile)
+    sage.load_history(history_tail)
+    return sage
+
 def clear_sage_instance(user_id):
     if user_id in _sage_instances:
         del _sage_instances[user_id]
 
+def _title_request(first_message):
+    return dict(
+        model=CLAUDE_MODEL,
+        max_tokens=20,
+        messages=[{"role": "user", "content": f"""Generate a very short title (2-4 words max) for a health chat that starts with this message: "{first_message}" Just respond with the short title, nothing else."""}]
+    )
+
+def _clean_title(response):
+    _record_usage('title', response)
+    title = response.content[0].text.strip().replace('"', '').replace("'", "")[:50]
+    return title if title else "Health Chat"
+
+def _fallback_title(first_message):
+    words = first_message.split()[:4]
+    return ' '.join(words)[:50] if words else "Health Chat"
+
 def generate_chat_title(first_message):
     try:
         client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
-        response = client.messages.create(
-            model="claude-sonnet-4-20250514",
-            max_tokens=20,
-            messages=[{"role": "user", "content": f"""Generate a very short title (2-4 words max) for a health chat that starts with this message: "{first_message}" Just respond with the short title, nothing else."""}]
-        )
-        title = response.content[0].text.strip().replace('"', '').replace("'", "")[:50]
-        return title if title else "Health Chat"
+        with _anthropic_call('title'):
+            response = client.messages.create(**_title_request(first_message))
+        return _clean_title(response)
+    except Exception as e:
+        return _fallback_title(first_message)
+
+async def agenerate_chat_title(first_message):
+    try:
+        with _anthropic_call('title'):
+            response = await _get_async_client().messages.create(**_title_request(first_message))
+        return _clean_title(response)
     except Exception as e:
-        words = first_message.split()[:4]
-        return ' '.join(words)[:50] if words else "Health Chat"
\ No newline at end of file
+        return _fallback_title(first_message)
\ No newline at end of file
@@ -0,0 +1,132 @@
+"""
+Sage - Request Tracing
+Lightweight spans: each request opens a trace, and nested span() blocks
+(database helpers, retrieval, Anthropic calls) attach to it through a
+context variable, so they follow the request across asyncio tasks and
+asyncio.to_thread. Requests slower than SLOW_REQUEST_SECONDS are logged
+with their span tree. Outside a trace span() does nothing.
+"""
+
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from logs import get_logger
+
+logger = get_logger(__name__)
+
+TRACING_ENABLED = os.environ.get('TRACING_ENABLED', 'true').lower() == 'true'
+SLOW_REQUEST_SECONDS = float(os.environ.get('SLOW_REQUEST_SECONDS', 2.0))
+MAX_SPANS_PER_TRACE = int(os.environ.get('MAX_SPANS_PER_TRACE', 500))
+
+_current = contextvars.ContextVar('sage_current_span', default=None)
+
+
+class Span:
+    __slots__ = ('name', 'attrs', 'started', 'duration', 'children', 'root', 'span_count')
+
+    def __init__(self, name, attrs, root=None):
+        self.name = name
+        self.attrs = attrs
+        self.started = time.perf_counter()
+        self.duration = None
+        self.children = []
+        self.root = root or self
+        self.span_count = 1
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.started
+
+
+@contextmanager
+def span(name, **attrs):
+    """Time the enclosed block as a child of the current span."""
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    root = parent.root
+    if root.span_count >= MAX_SPANS_PER_TRACE:
+        yield None
+        return
+    root.span_count += 1
+    child = Span(name, attrs, root)
+    parent.children.append(child)
+    token = _current.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.attrs['error'] = type(e).__name__
+        raise
+    finally:
+        child.finish()
+        _current.reset(token)
+
+
+def traced(name=None):
+    """Decorator: run every call inside span(name or the function name)."""
+    def decorator(fn):
+        span_name = name or fn.__name__
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# ============== REQUEST TRACES ==============
+
+def start_trace(name, **attrs):
+    """Open a root span for this request. Pass the result to finish_trace()."""
+    if not TRACING_ENABLED:
+        return None
+    root = Span(name, attrs)
+    return root, _current.set(root)
+
+
+def finish_trace(handle, **attrs):
+    """Close a trace from start_trace() and log its span tree if it was slow."""
+    if handle is None:
+        return
+    root, token = handle
+    root.finish()
+    root.attrs.update(attrs)
+    try:
+        _current.reset(token)
+    except ValueError:  # finished from another context; just detach
+        _current.set(None)
+    if root.duration >= SLOW_REQUEST_SECONDS:
+        logger.warning("Slow request (%.0f ms):\n%s", root.duration * 1000, format_span_tree(root),
+                       extra={'event': 'slow_request', 'route': root.name, 'duration_ms': round(root.duration * 1000)})
+
+
+@contextmanager
+def trace(name, **attrs):
+    """start_trace()/finish_trace() as a with-block, for the ASGI routes and scripts."""
+    handle = start_trace(name, **attrs)
+    try:
+        yield handle[0] if handle else None
+    finally:
+        finish_trace(handle)
+
+
+def format_span_tree(root):
+    """Indented span tree with durations, children in start order."""
+    lines = []
+
+    def walk(node, depth):
+        elapsed = f"{node.duration * 1000:.1f} ms" if node.duration is not None else "running"
+        attrs = ' '.join(f"{key}={value}" for key, value in node.attrs.items())
+        offset = (node.started - root.started) * 1000
+        lines.append(f"{'  ' * depth}{node.name} {elapsed} (+{offset:.1f} ms){' ' + attrs if attrs else ''}")
+        for child in sorted(node.children, key=lambda c: c.started):
+            walk(child, depth + 1)
+
+    walk(root, 0)
+    if root.span_count >= MAX_SPANS_PER_TRACE:
+        lines.append(f"  ... span limit of {MAX_SPANS_PER_TRACE} reached, later spans dropped")
+    return '\n'.join(lines)
@@ -0,0 +1,76 @@
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+
+from responses import dumps_json, compress_body, brotli
+
+MESSAGES = 1_000
+ROUNDS = 200
+
+WORDS = ['headache', 'fever', 'paracetamol', 'sleep', 'water', 'doctor', 'rest', 'pain', 'since',
+         'yesterday', 'morning', 'feel', 'better', 'try', 'drink', 'warm', 'take', 'your', 'and', 'the']
+
+
+def make_session(rng):
+    """A 1,000-message session shaped like get_chat_history_page rows."""
+    started = datetime(2025, 1, 1, 9, 0, 0)
+    return [{
+        'id': 100000 + i,
+        'message': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(8, 60))),
+        'sender': 'user' if i % 2 == 0 else 'sage',
+        'created_at': started + timedelta(seconds=37 * i),
+    } for i in range(MESSAGES)]
+
+
+def old_encode(messages):
+    """Previous path: convert datetimes in a Python loop, then Flask's stdlib encoder."""
+    for msg in messages:
+        msg['created_at'] = msg['created_at'].isoformat() if msg['created_at'] else None
+    return json.dumps({'messages': messages, 'next_before_id': None}, sort_keys=True).encode('utf-8')
+
+
+def new_encode(messages):
+    return dumps_json({'messages': messages, 'next_before_id': None})
+
+
+def time_ms(fn, make_input):
+    samples = []
+    for _ in range(ROUNDS):
+        data = make_input()
+        t0 = time.perf_counter()
+        fn(data)
+        samples.append((time.perf_counter() - t0) * 1000)
+    samples.sort()
+    return samples[len(samples) // 2]
+
+
+def run_benchmark():
+    rng = random.Random(7)
+    messages = make_session(rng)
+
+    old_ms = time_ms(old_encode, lambda: [dict(m) for m in messages])
+    new_ms = time_ms(new_encode, lambda: messages)
+    body = new_encode(messages)
+    assert json.loads(body) == json.loads(old_encode([dict(m) for m in messages]))
+
+    print(f"Encoding a {MESSAGES}-message session (median of {ROUNDS})")
+    print(f"  stdlib json + isoformat loop: {old_ms:7.2f} ms")
+    print(f"  orjson, native datetimes:     {new_ms:7.2f} ms  ({old_ms / new_ms:.1f}x faster)\n")
+
+    print(f"{'Encoding':<10}{'bytes':>10}{'ratio':>8}{'ms':>8}")
+    print(f"{'identity':<10}{len(body):>10,}{1:>8.2f}{'-':>8}")
+    for encoding in ('gzip', 'br') if brotli else ('gzip',):
+        compress_ms = time_ms(lambda b: compress_body(b, encoding), lambda: body)
+        size = len(compress_body(body, encoding))
+        print(f"{encoding:<10}{size:>10,}{size / len(body):>8.2f}{compress_ms:>8.2f}")
+    if not brotli:
+        print("(brotli not installed; br skipped)")
+
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,83 @@
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+
+import bcrypt
+
+from passwords import (check_password, hash_password, PasswordHasherBusy, BCRYPT_ROUNDS,
+                       WEB_THREADS, PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_PENDING)
+
+REQUEST_THREADS = WEB_THREADS  # matches gunicorn --threads
+LOGIN_BURST = 200
+CHAT_REQUESTS = 100
+CHAT_INTERVAL = 0.02       # one chat request every 20 ms during the burst
+CHAT_WORK_SECONDS = 0.01   # simulated I/O inside a chat request
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def chat_request():
+    time.sleep(CHAT_WORK_SECONDS)
+
+
+def inline_login(password, hashed):
+    """Old behaviour: bcrypt on the request thread."""
+    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+
+def pooled_login(password, hashed):
+    try:
+        return check_password(password, hashed)
+    except PasswordHasherBusy:
+        return None  # shed with 503
+
+
+def run_scenario(login_fn, hashed):
+    """Fire a login burst and a steady trickle of chats at one request pool."""
+    pool = ThreadPoolExecutor(max_workers=REQUEST_THREADS)
+    started = time.perf_counter()
+    logins = [pool.submit(login_fn, 'correct horse', hashed) for _ in range(LOGIN_BURST)] if login_fn else []
+
+    chat_latencies = []
+    chats = []
+    for _ in range(CHAT_REQUESTS):
+        submitted = time.perf_counter()
+        future = pool.submit(chat_request)
+        future.add_done_callback(lambda f, t=submitted: chat_latencies.append(time.perf_counter() - t))
+        chats.append(future)
+        time.sleep(CHAT_INTERVAL)
+
+    results = [f.result() for f in logins]
+    for f in chats:
+        f.result()
+    elapsed = time.perf_counter() - started
+    pool.shutdown()
+
+    ok = sum(1 for r in results if r)
+    shed = sum(1 for r in results if r is None)
+    return [l * 1000 for l in chat_latencies], ok, shed, elapsed
+
+
+def run_benchmark():
+    print(f"bcrypt rounds={BCRYPT_ROUNDS}, {REQUEST_THREADS} request threads, "
+          f"{PASSWORD_HASH_WORKERS} hash workers, max pending {PASSWORD_HASH_MAX_PENDING}, "
+          f"{LOGIN_BURST} logins + {CHAT_REQUESTS} chats\n")
+    hashed = hash_password('correct horse')
+
+    print(f"{'Scenario':<16}{'chat p50':>10}{'chat p95':>10}{'chat p99':>10}{'logins ok':>11}{'shed':>6}"
+          f"{'accepted':>10}{'logins/s':>10}")
+    for label, login_fn in (('no logins', None), ('inline bcrypt', inline_login), ('bcrypt pool', pooled_login)):
+        latencies, ok, shed, elapsed = run_scenario(login_fn, hashed)
+        accepted = f"{100 * ok / LOGIN_BURST:.0f}%" if login_fn else '-'
+        print(f"{label:<16}{percentile(latencies, 50):>9.1f}ms{percentile(latencies, 95):>9.1f}ms"
+              f"{percentile(latencies, 99):>9.1f}ms{ok:>11}{shed:>6}{accepted:>10}{ok / elapsed:>10.1f}")
+
+
+if __name__ == "__main__":
+    run_benchmark()
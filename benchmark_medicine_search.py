@@ -0,0 +1,106 @@
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+
+from medicine_index import MedicineIndex, prefix_distance, max_edits
+
+CATALOGUE_SIZE = 300_000
+QUERIES = 2_000
+P99_TARGET_MS = 25.0
+
+SYLLABLES = ['para', 'ceta', 'mol', 'amox', 'icil', 'lin', 'azi', 'thro', 'my', 'cin', 'met', 'for',
+             'min', 'ator', 'va', 'sta', 'tin', 'pan', 'to', 'pra', 'zole', 'cef', 'ixi', 'me',
+             'dol', 'o', 'levo', 'flox', 'acin', 'mon', 'te', 'lu', 'kast', 'dex', 'tro', 'xa']
+COMPOSITIONS = ['Paracetamol (500mg)', 'Amoxycillin (250mg)', 'Azithromycin (500mg)', 'Metformin (500mg)',
+                'Atorvastatin (10mg)', 'Pantoprazole (40mg)', 'Cefixime (200mg)', 'Levofloxacin (500mg)',
+                'Montelukast (10mg)', 'Dextromethorphan (10mg)']
+
+
+def make_catalogue(rng):
+    """Synthetic drug-like names: 2-4 syllables plus a strength/form suffix."""
+    rows = []
+    for _ in range(CATALOGUE_SIZE):
+        base = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+        name = f"{base} {rng.choice(['100mg', '250mg', '500mg', 'Tablet', 'Syrup', 'Injection'])}"
+        rows.append((name, 'Sage Pharma', 'strip of 10 tablets', rng.choice(COMPOSITIONS), rng.randint(10, 500)))
+    return rows
+
+
+def add_typo(word, rng):
+    """Apply one random substitution, deletion, insertion, or transposition."""
+    i = rng.randrange(1, len(word) - 1)
+    kind = rng.choice(['sub', 'del', 'ins', 'swap'])
+    letter = rng.choice('abcdefghijklmnopqrstuvwxyz')
+    if kind == 'sub':
+        return word[:i] + letter + word[i + 1:]
+    if kind == 'del':
+        return word[:i] + word[i + 1:]
+    if kind == 'ins':
+        return word[:i] + letter + word[i:]
+    return word[:i - 1] + word[i] + word[i - 1] + word[i + 1:]
+
+
+def is_hit(clean, typo, found):
+    """
+    The intended name was returned, or the top 15 were filled with names
+    at least as close to the typed query (synthetic names collide a lot).
+    """
+    if any(r['name'].lower().startswith(clean) for r in found):
+        return True
+    k = max_edits(typo)
+    intended = prefix_distance(typo, clean, k)
+    return len(found) == 15 and all(
+        min(prefix_distance(typo, word, k) for word in r['name'].lower().split()) <= intended
+        for r in found
+    )
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def run_benchmark():
+    rng = random.Random(42)
+    rows = make_catalogue(rng)
+
+    print(f"Building index over {len(rows)} medicines...")
+    started = time.perf_counter()
+    index = MedicineIndex(rows)
+    print(f"Built in {time.perf_counter() - started:.1f}s ({len(index.words)} distinct words)\n")
+
+    queries = []
+    while len(queries) < QUERIES:
+        word = rng.choice(rows)[0].split()[0].lower()
+        if len(word) < 6:
+            continue
+        prefix = word[:rng.randint(5, min(10, len(word)))]
+        queries.append((prefix, add_typo(prefix, rng)))
+
+    results = {}
+    hits = 0
+    for label, search, pick in (('exact', index.search, 0), ('fuzzy', index.fuzzy_search, 1)):
+        timings = []
+        for clean, typo in queries:
+            query = (clean, typo)[pick]
+            t0 = time.perf_counter()
+            found = search(query)
+            timings.append((time.perf_counter() - t0) * 1000)
+            if label == 'fuzzy' and is_hit(clean, typo, found):
+                hits += 1
+        results[label] = timings
+
+    print(f"{'Mode':<8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for label, timings in results.items():
+        print(f"{label:<8}{percentile(timings, 50):>10.3f}{percentile(timings, 95):>10.3f}{percentile(timings, 99):>10.3f}")
+
+    fuzzy_p99 = percentile(results['fuzzy'], 99)
+    print(f"\nFuzzy recall (intended or equally close names in top 15): {hits / QUERIES * 100:.1f}%")
+    print(f"Fuzzy p99 target {P99_TARGET_MS} ms: {'PASS' if fuzzy_p99 <= P99_TARGET_MS else 'FAIL'}")
+
+
+if __name__ == "__main__":
+    run_benchmark()
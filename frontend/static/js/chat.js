@@ -2,6 +2,7 @@
 
 let selectedFile = null;
 let currentSessionId = null;
+let olderMessagesCursor = null;
 // ===== THEME TOGGLE =====
 function toggleTheme() {
     const body = document.body;
@@ -97,6 +98,7 @@ async function loadSession(sessionId) {
             data.messages.forEach(msg => {
                 addMessageToUI(msg.message, msg.sender === 'user' ? 'user' : 'sage');
             });
+            setOlderMessagesCursor(data.next_before_id);
             
             loadChatSessions();
             toggleSidebar();
@@ -107,6 +109,46 @@ async function loadSession(sessionId) {
     }
 }
 
+// ===== OLDER MESSAGES (PAGINATION) =====
+function setOlderMessagesCursor(cursor) {
+    olderMessagesCursor = cursor || null;
+    const wrapper = document.getElementById('messagesWrapper');
+    let button = document.getElementById('loadEarlierBtn');
+    
+    if (!olderMessagesCursor) {
+        if (button) button.remove();
+        return;
+    }
+    if (!button) {
+        button = document.createElement('button');
+        button.id = 'loadEarlierBtn';
+        button.className = 'load-earlier';
+        button.textContent = 'Load earlier messages';
+        button.onclick = loadEarlierMessages;
+    }
+    wrapper.insertBefore(button, wrapper.firstChild);
+}
+
+async function loadEarlierMessages() {
+    if (!currentSessionId || !olderMessagesCursor) return;
+    
+    try {
+        const response = await fetch(`/api/sessions/${currentSessionId}/messages?before=${olderMessagesCursor}`);
+        const data = await response.json();
+        if (!data.messages) return;
+        
+        const wrapper = document.getElementById('messagesWrapper');
+        const firstMessage = wrapper.querySelector('.message:not(.typing-indicator)');
+        data.messages.forEach(msg => {
+            const div = createMessageElement(msg.message, msg.sender === 'user' ? 'user' : 'sage');
+            wrapper.insertBefore(div, firstMessage);
+        });
+        setOlderMessagesCursor(data.next_before_id);
+    } catch (error) {
+        console.error('Error loading earlier messages:', error);
+    }
+}
+
 async function deleteSession(sessionId) {
     if (!confirm('Delete this conversation?')) return;
     
@@ -123,6 +165,7 @@ async function startNewChat() {
     try {
         await fetch('/api/new-chat', { method: 'POST' });
         currentSessionId = null;
+        setOlderMessagesCursor(null);
         
         // Reset layout - move input back inside wrapper
         const bottomSection = document.getElementById('bottomSection');
@@ -190,8 +233,7 @@ async function sendMessage() {
         showTypingIndicator();
         
         try {
-            const response = await fetch('/api/chat', {
-                method: 'POST',
+            const response = await postWithRetry('/api/chat', {
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify({ message })
             });
@@ -214,6 +256,12 @@ function sendSuggestion(text) {
 function addMessageToUI(text, sender) {
     const wrapper = document.getElementById('messagesWrapper');
     const typingIndicator = document.getElementById('typingIndicator');
+    
+    wrapper.insertBefore(createMessageElement(text, sender), typingIndicator);
+    scrollToBottom();
+}
+
+function createMessageElement(text, sender) {
     const time = new Date().toLocaleTimeString([], { hour: '2-digit', minute: '2-digit' });
     
     const div = document.createElement('div');
@@ -243,8 +291,7 @@ function addMessageToUI(text, sender) {
         `;
     }
     
-    wrapper.insertBefore(div, typingIndicator);
-    scrollToBottom();
+    return div;
 }
 
 function escapeHtml(text) {
@@ -300,11 +347,31 @@ async function uploadFile(file, message) {
     formData.append('file', file);
     formData.append('message', message || 'Please analyze this.');
     
-    const response = await fetch('/api/upload', { method: 'POST', body: formData });
+    const response = await postWithRetry('/api/upload', { body: formData });
     if (!response.ok) throw new Error('Upload failed');
     return response.json();
 }
 
+// ===== RETRIES =====
+function newIdempotencyKey() {
+    if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+    return `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+}
+
+// Retries network failures with the same Idempotency-Key, so the server
+// saves the message and calls the model only once
+async function postWithRetry(url, options, attempts = 3) {
+    const headers = { ...(options.headers || {}), 'Idempotency-Key': newIdempotencyKey() };
+    for (let attempt = 1; ; attempt++) {
+        try {
+            return await fetch(url, { ...options, method: 'POST', headers });
+        } catch (error) {
+            if (attempt >= attempts) throw error;
+            await new Promise(resolve => setTimeout(resolve, 500 * attempt));
+        }
+    }
+}
+
 // ===== KEYBOARD =====
 function handleKeyPress(event) {
     if (event.key === 'Enter' && !event.shiftKey) {
@@ -0,0 +1,433 @@
+let medications = [];
+let todayLogs = [];
+let searchTimeout = null;
+let searchController = null;
+// Autocomplete results by lowercased query; a complete result (< 15 rows)
+// answers every longer query that extends it without a request
+const searchCache = new Map();
+const SEARCH_LIMIT = 15;
+const searchStats = { keystrokes: 0, requests: 0 };
+
+document.addEventListener('DOMContentLoaded', () => {
+    loadData();
+    setupNotifications();
+});
+
+// Setup Browser Notifications
+function setupNotifications() {
+    if ("Notification" in window) {
+        if (Notification.permission !== "granted" && Notification.permission !== "denied") {
+            Notification.requestPermission();
+        }
+    }
+    setInterval(checkReminders, 60000); // Check every minute
+}
+
+// Autocomplete setup
+const medicineInput = document.getElementById('medicineName');
+const autocompleteList = document.getElementById('autocompleteList');
+
+medicineInput.addEventListener('input', function() {
+    const query = this.value.trim();
+    clearTimeout(searchTimeout);
+    searchStats.keystrokes++;
+    
+    if (query.length < 2) {
+        if (searchController) searchController.abort();
+        autocompleteList.classList.remove('show');
+        return;
+    }
+    
+    const cached = cachedResults(query);
+    if (cached) {
+        if (searchController) searchController.abort();
+        renderSearchResults(cached, query);
+        return;
+    }
+    
+    autocompleteList.innerHTML = '<div class="autocomplete-loading">Searching...</div>';
+    autocompleteList.classList.add('show');
+    
+    searchTimeout = setTimeout(() => {
+        searchMedicines(query);
+    }, 250);
+});
+
+medicineInput.addEventListener('blur', function() {
+    setTimeout(() => autocompleteList.classList.remove('show'), 200);
+});
+
+function cachedResults(query) {
+    const q = query.toLowerCase();
+    if (searchCache.has(q)) return searchCache.get(q).medicines;
+    
+    // Look for the longest cached prefix whose result set was complete
+    for (let len = q.length - 1; len >= 2; len--) {
+        const entry = searchCache.get(q.slice(0, len));
+        if (!entry) continue;
+        if (entry.fuzzy || entry.medicines.length >= SEARCH_LIMIT) return null;
+        
+        // Same ordering as the server: prefix matches first, then by name
+        const matches = entry.medicines.filter(m => m.name.toLowerCase().includes(q));
+        const starts = matches.filter(m => m.name.toLowerCase().startsWith(q));
+        const others = matches.filter(m => !m.name.toLowerCase().startsWith(q));
+        return matches.length ? starts.concat(others) : null;
+    }
+    return null;
+}
+
+async function searchMedicines(query) {
+    // Cancel the request for an older query still in flight
+    if (searchController) searchController.abort();
+    searchController = new AbortController();
+    
+    try {
+        searchStats.requests++;
+        const response = await fetch(`/api/medicines/search?q=${encodeURIComponent(query)}`, {
+            signal: searchController.signal
+        });
+        const data = await response.json();
+        searchCache.set(query.toLowerCase(), { medicines: data.medicines || [], fuzzy: !!data.fuzzy });
+        renderSearchResults(data.medicines || [], query);
+    } catch (error) {
+        if (error.name === 'AbortError') return;
+        console.error('Search error:', error);
+        autocompleteList.innerHTML = '<div class="autocomplete-loading">Search failed</div>';
+    }
+}
+
+function renderSearchResults(medicines, query) {
+    if (medicines.length > 0) {
+        // FIXED: using onmousedown instead of onclick
+        autocompleteList.innerHTML = medicines.map(med => `
+            <div class="autocomplete-item" onmousedown="selectMedicine('${escapeHtml(med.name)}', '${escapeHtml(med.pack_size || '')}')">
+                <div class="med-name">${highlightMatch(med.name, query)}</div>
+                <div class="med-info">${med.manufacturer || ''} ${med.pack_size ? '• ' + med.pack_size : ''}</div>
+            </div>
+        `).join('');
+    } else {
+        autocompleteList.innerHTML = `
+            <div class="autocomplete-item" onmousedown="selectMedicine('${escapeHtml(query)}', '')">
+                <div class="med-name">Use "${query}"</div>
+                <div class="med-info">Add as custom medicine</div>
+            </div>
+        `;
+    }
+    autocompleteList.classList.add('show');
+}
+
+function selectMedicine(name, packSize) {
+    // Requests actually sent versus keystrokes typed for this name
+    console.debug(`Autocomplete: ${searchStats.requests} requests for ${searchStats.keystrokes} keystrokes`);
+    searchStats.keystrokes = 0;
+    searchStats.requests = 0;
+    
+    document.getElementById('medicineName').value = name;
+    if (packSize && !document.getElementById('dosage').value) {
+        document.getElementById('dosage').value = packSize;
+    }
+    autocompleteList.classList.remove('show');
+}
+
+function highlightMatch(text, query) {
+    const regex = new RegExp(`(${query})`, 'gi');
+    return text.replace(regex, '<strong style="color:#3dbda7">$1</strong>');
+}
+
+function escapeHtml(text) {
+    const div = document.createElement('div');
+    div.textContent = text || '';
+    return div.innerHTML.replace(/'/g, "\\'");
+}
+
+// Dynamic Time Picker logic
+function addTimeInput(value = "08:00") {
+    const container = document.getElementById('timeInputsContainer');
+    const row = document.createElement('div');
+    row.className = 'time-input-row';
+    row.innerHTML = `
+        <input type="time" class="time-picker" value="${value}" required>
+        <button type="button" class="remove-time-btn" onclick="if(document.querySelectorAll('.time-picker').length > 1) this.parentElement.remove()">✕</button>
+    `;
+    container.appendChild(row);
+}
+
+// Modal functions
+function openModal(id = null) {
+    document.getElementById('modalOverlay').classList.add('show');
+    document.getElementById('modalTitle').textContent = id ? 'Edit Medicine' : 'Add Medicine';
+    document.getElementById('editId').value = id || '';
+    
+    document.getElementById('timeInputsContainer').innerHTML = ''; // Clear times
+    
+    if (id) {
+        const med = medications.find(m => m.id === id);
+        if (med) {
+            document.getElementById('medicineName').value = med.medicine_name;
+            document.getElementById('dosage').value = med.dosage || '';
+            document.getElementById('frequency').value = med.frequency || 'Daily';
+            document.getElementById('notes').value = med.notes || '';
+            
+            // Populate exact times
+            if (med.times && med.times.length > 0) {
+                med.times.forEach(t => addTimeInput(t));
+            } else {
+                addTimeInput();
+            }
+        }
+    } else {
+        document.getElementById('medicineForm').reset();
+        document.getElementById('frequency').value = 'Daily';
+        addTimeInput(); // Add one default time picker
+    }
+}
+
+function closeModal(event) {
+    if (!event || event.target === document.getElementById('modalOverlay')) {
+        document.getElementById('modalOverlay').classList.remove('show');
+        document.getElementById('medicineForm').reset();
+    }
+}
+
+async function saveMedicine(event) {
+    event.preventDefault();
+    
+    const times = Array.from(document.querySelectorAll('.time-picker')).map(input => input.value);
+    
+    if (times.length === 0) {
+        alert('Please add at least one reminder time.');
+        return;
+    }
+    
+    const data = {
+        medicine_name: document.getElementById('medicineName').value,
+        dosage: document.getElementById('dosage').value,
+        frequency: document.getElementById('frequency').value,
+        times: times,
+        notes: document.getElementById('notes').value
+    };
+    
+    const editId = document.getElementById('editId').value;
+    const url = editId ? `/api/medications/${editId}` : '/api/medications';
+    const method = editId ? 'PUT' : 'POST';
+    
+    try {
+        const response = await fetch(url, {
+            method: method,
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(data)
+        });
+        
+        if (response.ok) {
+            closeModal();
+            loadData(); 
+        } else {
+            alert('Failed to save medicine');
+        }
+    } catch (error) {
+        console.error('Save error:', error);
+        alert('Failed to save medicine');
+    }
+}
+
+async function loadData() {
+    try {
+        // One request; unchanged dashboards come back as 304 from the browser cache
+        const response = await fetch('/api/medications/dashboard');
+        const data = await response.json();
+        
+        medications = data.medications || [];
+        todayLogs = medications.flatMap(med => (med.slots || [])
+            .filter(slot => slot.status)
+            .map(slot => ({ medication_id: med.id, time_slot: slot.time_slot, status: slot.status })));
+        
+        renderMedications();
+        updateScheduleCounts();
+    } catch (error) {
+        console.error('Load data error:', error);
+    }
+}
+
+function formatTime(timeStr) {
+    if (!timeStr) return '';
+    let [hours, minutes] = timeStr.split(':');
+    hours = parseInt(hours);
+    const ampm = hours >= 12 ? 'PM' : 'AM';
+    hours = hours % 12;
+    hours = hours ? hours : 12; 
+    return `${hours}:${minutes} ${ampm}`;
+}
+
+function renderMedications() {
+    const list = document.getElementById('medicineList');
+    
+    if (medications.length === 0) {
+        list.innerHTML = `
+            <div class="empty-state">
+                <svg viewBox="0 0 24 24" fill="none" stroke="currentColor" stroke-width="1.5">
+                    <path d="M19 3H5a2 2 0 00-2 2v14a2 2 0 002 2h14a2 2 0 002-2V5a2 2 0 00-2-2z"/>
+                    <path d="M12 8v8M8 12h8"/>
+                </svg>
+                <h3>No medicines added yet</h3>
+                <p>Add your first medicine reminder to get started</p>
+            </div>
+        `;
+        return;
+    }
+    
+    list.innerHTML = medications.map(med => `
+        <div class="medicine-item">
+            <div class="medicine-info" style="width:100%">
+                <div style="display:flex; justify-content:space-between;">
+                    <div class="medicine-name">${med.medicine_name} <span style="font-size:0.8rem; background:#eee; padding:2px 8px; border-radius:10px; color:#555; margin-left:8px;">${med.frequency || 'Daily'}</span></div>
+                    <div class="medicine-actions">
+                        <button class="action-btn" onclick="openModal(${med.id})" title="Edit">✏️</button>
+                        <button class="action-btn delete" onclick="deleteMedicine(${med.id})" title="Delete">🗑️</button>
+                    </div>
+                </div>
+                <div class="medicine-details">${med.dosage || 'No dosage specified'}</div>
+                <div class="medicine-times" style="flex-direction: column; gap: 10px; margin-top: 15px;">
+                    ${(med.times || []).map(time => renderTimeSlot(med, time)).join('')}
+                </div>
+            </div>
+        </div>
+    `).join('');
+}
+
+function renderTimeSlot(med, time) {
+    const log = todayLogs.find(l => l.medication_id === med.id && l.time_slot === time);
+    
+    let actionHtml = '';
+    if (log && log.status === 'taken') {
+        actionHtml = `<span style="color: #27ae60; font-weight: 600;">✅ Taken</span>`;
+    } else if (log && log.status === 'missed') {
+        actionHtml = `<span style="color: #e74c3c; font-weight: 600;">❌ Missed</span>`;
+    } else {
+        actionHtml = `
+            <button onclick="logMedication(${med.id}, '${time}', 'taken')" style="background: #27ae60; color: white; border: none; padding: 5px 10px; border-radius: 5px; cursor: pointer;">Take</button>
+            <button onclick="logMedication(${med.id}, '${time}', 'missed')" style="background: #e74c3c; color: white; border: none; padding: 5px 10px; border-radius: 5px; cursor: pointer; margin-left: 5px;">Skip</button>
+        `;
+    }
+
+    return `
+        <div style="display: flex; justify-content: space-between; align-items: center; background: rgba(255,255,255,0.7); padding: 8px 12px; border-radius: 8px;">
+            <span class="time-badge">⏰ ${formatTime(time)}</span>
+            <div>${actionHtml}</div>
+        </div>
+    `;
+}
+
+async function logMedication(medId, timeSlot, status) {
+    try {
+        const response = await fetch('/api/medications/log', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ medication_id: medId, time_slot: timeSlot, status: status })
+        });
+        if(response.ok) {
+            loadData(); 
+        }
+    } catch (e) {
+        console.error("Logging failed", e);
+    }
+}
+
+async function deleteMedicine(id) {
+    if (!confirm('Are you sure you want to delete this medicine?')) return;
+    try {
+        const response = await fetch(`/api/medications/${id}`, { method: 'DELETE' });
+        if (response.ok) loadData();
+    } catch (error) {
+        console.error('Delete error:', error);
+    }
+}
+
+function updateScheduleCounts() {
+    let pending = 0;
+    let taken = 0;
+    let missed = 0;
+    
+    const now = new Date();
+    
+    medications.forEach(med => {
+        // If alternate day, check if it's scheduled for today
+        if (med.frequency === 'Alternate') {
+            const createdDate = new Date(med.created_at);
+            const daysDiff = Math.floor((now - createdDate) / (1000 * 60 * 60 * 24));
+            if (daysDiff % 2 !== 0) return; // Skip counting if it's an off day
+        }
+        
+        (med.times || []).forEach(time => {
+            const log = todayLogs.find(l => l.medication_id === med.id && l.time_slot === time);
+            if (!log) {
+                pending++;
+            } else if (log.status === 'taken') {
+                taken++;
+            } else if (log.status === 'missed') {
+                missed++;
+            }
+        });
+    });
+    
+    document.getElementById('pendingCount').textContent = pending;
+    document.getElementById('takenCount').textContent = taken;
+    document.getElementById('missedCount').textContent = missed;
+}
+
+async function checkReminders() {
+    // Prefer due-dose events from the server scheduler once it knows our timezone
+    try {
+        const tz = Intl.DateTimeFormat().resolvedOptions().timeZone || '';
+        const response = await fetch('/api/medications/due?tz=' + encodeURIComponent(tz));
+        const data = await response.json();
+        if (data.scheduler) {
+            (data.events || []).forEach(event => {
+                const alreadyLogged = todayLogs.some(l => l.medication_id === event.medication_id && l.time_slot === event.time_slot);
+                if (!alreadyLogged) {
+                    sendBrowserNotification(event.medicine_name, event.dosage, formatTime(event.time_slot));
+                }
+            });
+            return;
+        }
+    } catch (error) {
+        console.error('Due reminders error:', error);
+    }
+    checkRemindersLocally();
+}
+
+function checkRemindersLocally() {
+    const now = new Date();
+    const currentHour = now.getHours();
+    const currentMin = now.getMinutes();
+
+    medications.forEach(med => {
+        // Handle Alternate Days
+        if (med.frequency === 'Alternate') {
+            const createdDate = new Date(med.created_at);
+            const daysDiff = Math.floor((now - createdDate) / (1000 * 60 * 60 * 24));
+            if (daysDiff % 2 !== 0) return; // Skip if off day
+        }
+
+        (med.times || []).forEach(timeSlot => {
+            if(!timeSlot) return;
+            const [targetHour, targetMin] = timeSlot.split(':').map(Number);
+            
+            if (currentHour === targetHour && currentMin === targetMin) {
+                const alreadyLogged = todayLogs.some(l => l.medication_id === med.id && l.time_slot === timeSlot);
+                if (!alreadyLogged) {
+                    sendBrowserNotification(med.medicine_name, med.dosage, formatTime(timeSlot));
+                }
+            }
+        });
+    });
+}
+
+function sendBrowserNotification(medName, dosage, timeStr) {
+    if ("Notification" in window && Notification.permission === "granted") {
+        const text = `Time to take your ${timeStr} medicine: ${medName} ${dosage ? '('+dosage+')' : ''}`;
+        new Notification("💊 Sage Medicine Reminder", {
+            body: text,
+            icon: "🌿" 
+        });
+    }
+}